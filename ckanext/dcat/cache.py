@@ -0,0 +1,93 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class MemoryCache(object):
+    '''
+    In-process cache that keeps up to `max_size` values, discarding the
+    least recently used ones first. Values expire after `ttl` seconds.
+
+    Each process has its own copy, so it is mostly useful for single process
+    deployments and tests (see RedisCache for a shared one).
+    '''
+
+    def __init__(self, max_size=1000, ttl=300, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Returns the value stored for the key, or None if there is none or it
+        has expired
+        '''
+        with self._lock:
+            try:
+                expires, value = self._values.pop(key)
+            except KeyError:
+                return None
+            if expires <= self.clock():
+                return None
+            # Move it to the end, as the most recently used
+            self._values[key] = (expires, value)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._values.pop(key, None)
+            self._values[key] = (self.clock() + self.ttl, value)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+    def invalidate(self):
+        '''
+        Discards all values
+        '''
+        with self._lock:
+            self._values.clear()
+
+    def __len__(self):
+        return len(self._values)
+
+
+class RedisCache(object):
+    '''
+    Cache shared by all processes, stored on a Redis server. Values expire
+    after `ttl` seconds.
+
+    Keys are prefixed with a generation number stored on the server, so
+    invalidating the cache just increments it and the old values are left
+    to expire.
+
+    Requires the redis package, unless a `client` with the same interface
+    as `redis.StrictRedis` is provided.
+    '''
+
+    def __init__(self, url='redis://localhost:6379/0', ttl=300,
+                 prefix='ckanext-dcat:', client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError('The redis package is required to use '
+                                  'the Redis cache backend')
+            client = redis.StrictRedis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, key):
+        generation = self.client.get(self.prefix + 'generation') or 0
+        return '{0}{1}:{2}'.format(self.prefix, generation, key)
+
+    def get(self, key):
+        return self.client.get(self._key(key))
+
+    def set(self, key, value):
+        self.client.setex(self._key(key), self.ttl, value)
+
+    def invalidate(self):
+        self.client.incr(self.prefix + 'generation')
@@ -1,8 +1,43 @@
-import json
+import os
+import time
 import logging
+import datetime
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
 from pylons import config
 from ckan import plugins as p
+from ckan import model
+
+from ckanext.dcat import compress
+from ckanext.dcat.static import ShardedDump, atomic_path, write_pages
+
+
+def _init_worker_thread():
+    '''
+    Registers on a pool thread the objects that CKAN expects, as
+    CkanCommand does on the main one
+    '''
+    import pylons
+    from paste.registry import Registry
+    from ckan.lib.cli import MockTranslator
+
+    registry = Registry()
+    registry.prepare()
+    registry.register(pylons.translator, MockTranslator())
+
+
+def _get_page_json(page, with_ids=False):
+    '''
+    Returns the serialized DCAT representation of the datasets on a page of
+    the catalog
+    '''
+    from ckanext.dcat.plugins import dcat_json_page
+
+    try:
+        return dcat_json_page({'page': page}, with_ids)
+    finally:
+        model.Session.remove()
 
 
 class GenerateStaticDCATCommand(p.toolkit.CkanCommand):
@@ -12,13 +47,64 @@ class GenerateStaticDCATCommand(p.toolkit.CkanCommand):
     The generate command will generate a static file containing all of the
     datasets in the catalog in JSON format.
 
-    paster generate_static json <OUTPUT_FILE> -c <PATH_TO_CONFIG>
+    paster generate_static json <OUTPUT_FILE> [--gzip] [--workers=N]
+        [--incremental [--shard-size=N]] -c <PATH_TO_CONFIG>
+
+    Pages of datasets are read and converted by N threads (default 4). The
+    file is written to a temporary file first, and only replaces the
+    existing one once all datasets have been written.
+
+    With --gzip, a gzip compressed copy of the file is also written next to
+    it, with a .gz extension, so it can be served directly by a web server.
+
+    With --incremental, the datasets are also kept in shards of N datasets
+    (default 1000) in a <OUTPUT_FILE>.shards directory, along with an index
+    of the shard and last modification date of each one in
+    <OUTPUT_FILE>.index.json. On the next runs only the datasets modified
+    since the previous one are read, the deleted ones are found comparing
+    the ids on the index with the ones on the catalog, and only the shards
+    with changes are rewritten before joining all of them into the file.
+    The first run (or one without the index) reads all datasets.
+
+    The pages command will write the catalog to a directory as one file per
+    page, with the same contents as the pages of the DCAT JSON endpoint
+    (<PAGE>.json), along with a manifest.json file with the generation date,
+    the number of datasets and the SHA1 hash of each page.
+
+    paster generate_static pages <OUTPUT_DIR> [--gzip] [--workers=N]
+        -c <PATH_TO_CONFIG>
+
+    The directory is replaced once all pages have been written, and can be
+    served by a web server, setting ckanext.dcat.static_pages_url so page
+    requests to the endpoint are redirected to it.
     """
     summary = __doc__.split('\n')[0]
     usage = __doc__
     max_args = 2
     min_args = 2
 
+    parser = p.toolkit.CkanCommand.standard_parser(verbose=True)
+    parser.add_option('-c', '--config', dest='config',
+                      default='development.ini', help='Config file to use.')
+    parser.add_option('--gzip', dest='gzip', action='store_true',
+                      default=False,
+                      help='Also write a gzip compressed copy of the file')
+    parser.add_option('-w', '--workers', dest='workers', type='int',
+                      default=4,
+                      help='Number of threads reading pages of datasets')
+    parser.add_option('--incremental', dest='incremental',
+                      action='store_true', default=False,
+                      help='Only read the datasets modified since the '
+                           'previous run')
+    parser.add_option('--shard-size', dest='shard_size', type='int',
+                      default=1000,
+                      help='Number of datasets on each shard, when the '
+                           'shards are first written')
+
+    # Datasets modified shortly before the previous run started may not
+    # have been indexed yet, so they are read again
+    modified_since_margin = datetime.timedelta(minutes=10)
+
     def __init__(self, name):
         super(GenerateStaticDCATCommand, self).__init__(name)
 
@@ -27,40 +113,250 @@ class GenerateStaticDCATCommand(p.toolkit.CkanCommand):
         self.log = logging.getLogger(__name__)
 
         if len(self.args) != 2:
-            self.log.error("You must specify the command and the output file")
+            self.log.error("You must specify the command and the output file "
+                           "or directory")
             return
 
         cmd, output = self.args
 
-        if cmd == 'json':
+        if cmd == 'json' and self.options.incremental:
+            self.generate_incremental(output)
+        elif cmd == 'json':
             self.generate(output)
+        elif cmd == 'pages':
+            self.generate_pages(output)
         else:
             self.log.error("Unknown command {0}".format(cmd))
 
     def generate(self, output):
         """
-        Keep reading and converting datasets until we get an empty list back
-        from dcat_datasets_list
+        Writes all datasets to a temporary file next to the output file,
+        and moves it (and its compressed copy) into place once finished, so
+        the output file is never left incomplete
+        """
+        output = os.path.abspath(output)
+        with atomic_path(output) as temp_path:
+            with open(temp_path, 'w') as f:
+                self.write_datasets(f, self.options.workers)
+
+            if self.options.gzip:
+                with atomic_path(output + '.gz') as gzip_path:
+                    compress.gzip_file(temp_path, gzip_path)
+
+    def generate_pages(self, output_dir):
+        """
+        Writes each page of datasets to its own file in the output directory
+        """
+        from ckanext.dcat.plugins import get_datasets_per_page
+
+        generated = datetime.datetime.utcnow().replace(microsecond=0)
+        datasets_per_page = get_datasets_per_page()
+
+        manifest = write_pages(self.iter_pages(self.options.workers),
+                               output_dir, datasets_per_page,
+                               generated.isoformat(), self.options.gzip)
+        self.log.info('{0} datasets written on {1} pages'.format(
+            manifest['datasets'], manifest['pages']))
+
+    def generate_incremental(self, output):
+        """
+        Updates the shards with the datasets modified or deleted since the
+        previous run (or writes all of them if there was none), and then
+        writes the output file from them
+        """
+        from ckanext.dcat.plugins import get_dataset_ids
+
+        generated = datetime.datetime.utcnow().replace(microsecond=0)
+
+        dump = ShardedDump(output, self.options.shard_size)
+        if not dump.load():
+            self.log.info('No index found, reading all datasets')
+            dump.rebuild(dataset for datasets in
+                         self.iter_pages(self.options.workers, with_ids=True)
+                         for dataset in datasets)
+        else:
+            since = datetime.datetime.strptime(dump.generated,
+                                               '%Y-%m-%dT%H:%M:%S')
+            modified = self.get_modified_datasets(
+                since - self.modified_since_margin)
+
+            current_ids = get_dataset_ids()
+            deleted = [dataset_id for dataset_id in dump.datasets
+                       if dataset_id not in current_ids]
+
+            rewritten = dump.update(modified, deleted)
+            self.log.info('{0} datasets modified and {1} deleted since {2}, '
+                          '{3} shards rewritten'.format(
+                              len(modified), len(deleted), dump.generated,
+                              rewritten))
+
+        dump.save(generated.isoformat())
+        dump.write_output(self.options.gzip)
+        self.log.info('{0} datasets written'.format(len(dump.datasets)))
+
+    def get_modified_datasets(self, since):
+        """
+        Returns a list of (id, metadata_modified, serialized dataset) tuples
+        with the datasets modified since a date, most recent first
+        """
+        from ckanext.dcat.plugins import dcat_json_page
+
+        modified = []
+        page = 1
+        while True:
+            datasets = dcat_json_page({'modified_since': since.isoformat(),
+                                       'page': page}, with_ids=True)
+            if not datasets:
+                return modified
+            modified.extend(datasets)
+            page += 1
+
+    def write_datasets(self, f, workers):
+        """
+        Writes all datasets to the file in order as a JSON list. Returns the
+        number of datasets written.
+        """
+        total = 0
+
+        f.write('[')
+        for datasets in self.iter_pages(workers):
+            for dataset_json in datasets:
+                if total:
+                    f.write(', ')
+                f.write(dataset_json)
+                total += 1
+        f.write(']')
+
+        return total
+
+    def iter_pages(self, workers, with_ids=False):
+        """
+        Reads pages of datasets in a pool of threads, and yields them in
+        order until an empty page is found
         """
-        data_dict = {'page': 0}
+        start = time.time()
+        total = 0
 
-        with open(output, 'w') as f:
-            f.write(u"[")
+        pool = ThreadPool(workers, initializer=_init_worker_thread)
+        try:
+            # Keep a few pages requested in advance
+            pending = deque()
+            next_page = 1
 
             while True:
-                try:
-                    data_dict['page'] = data_dict['page'] + 1
-                    datasets = \
-                        p.toolkit.get_action('dcat_datasets_list')({},
-                                                                   data_dict)
-                except p.toolkit.ValidationError, e:
-                    self.log.exception(e)
-                    break
+                while len(pending) < workers * 2:
+                    pending.append(pool.apply_async(_get_page_json,
+                                                    (next_page, with_ids)))
+                    next_page += 1
 
+                datasets = pending.popleft().get()
                 if not datasets:
                     break
 
-                for dataset in datasets:
-                    f.write(json.dumps(dataset))
+                yield datasets
+                total += len(datasets)
+
+                elapsed = time.time() - start
+                self.log.info('{0} datasets read ({1:.1f} datasets/s)'
+                              .format(total, total / elapsed if elapsed else 0))
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+class DCATCommand(p.toolkit.CkanCommand):
+    """
+    Maintenance tasks for the DCAT harvesters.
+
+    The reindex_pending command will index all datasets that were created or
+    updated by harvest jobs with deferred indexing and are still waiting to
+    be indexed (eg because the job was interrupted or the search server was
+    not available).
+
+    paster dcat reindex_pending -c <PATH_TO_CONFIG>
+
+    The import command will import all the objects of a harvest job that are
+    waiting to be imported, using a pool of worker processes (by default the
+    value of ckanext.dcat.harvest.import_workers, or 1).
+
+    paster dcat import <JOB_ID> [<WORKERS>] -c <PATH_TO_CONFIG>
+
+    The backfill command will store the DCAT representation of all active
+    datasets, used when ckanext.dcat.precomputed_json is enabled. It needs
+    to be run when enabling it on a site with existing datasets.
+
+    paster dcat backfill -c <PATH_TO_CONFIG>
+    """
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    max_args = 3
+    min_args = 1
+
+    def __init__(self, name):
+        super(DCATCommand, self).__init__(name)
+
+    def command(self):
+        self._load_config()
+        self.log = logging.getLogger(__name__)
+
+        cmd = self.args[0]
+
+        if cmd == 'reindex_pending':
+            self.reindex_pending()
+        elif cmd == 'import':
+            if len(self.args) < 2:
+                self.log.error("You must specify the harvest job id")
+                return
+            workers = int(self.args[2]) if len(self.args) > 2 else None
+            self.import_job(self.args[1], workers)
+        elif cmd == 'backfill':
+            self.backfill()
+        else:
+            self.log.error("Unknown command {0}".format(cmd))
+
+    def reindex_pending(self):
+        from ckanext.dcat.harvesters import index_pending_packages
+
+        batch_size = int(config.get('ckanext.dcat.harvest.index_batch_size',
+                                    1000))
+        total = index_pending_packages(batch_size)
+        self.log.info("{0} datasets indexed".format(total))
+
+    def import_job(self, job_id, workers=None):
+        from ckanext.harvest.model import HarvestJob
+        from ckanext.harvest.interfaces import IHarvester
+
+        job = HarvestJob.get(job_id)
+        if not job:
+            self.log.error("Harvest job {0} not found".format(job_id))
+            return
+
+        for harvester in p.PluginImplementations(IHarvester):
+            if harvester.info()['name'] == job.source.type:
+                break
+        else:
+            self.log.error("No harvester found for type {0}"
+                           .format(job.source.type))
+            return
+
+        if not hasattr(harvester, 'import_job'):
+            self.log.error("Harvester {0} does not support parallel imports"
+                           .format(job.source.type))
+            return
+
+        job_id = job.id
+
+        # The import workers are forked from this process, and connections
+        # can not be shared between processes
+        model.Session.remove()
+        model.meta.engine.dispose()
+
+        imported, errors = harvester.import_job(job_id, workers)
+        self.log.info("{0} objects imported, {1} errors".format(imported,
+                                                              errors))
+
+    def backfill(self):
+        from ckanext.dcat.plugins import backfill_dcat_json
 
-            f.write(u"]")
+        total = backfill_dcat_json()
+        self.log.info("DCAT JSON stored for {0} datasets".format(total))
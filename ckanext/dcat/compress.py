@@ -0,0 +1,70 @@
+import zlib
+import gzip
+import shutil
+
+
+CHUNK_SIZE = 1024 * 64
+
+# zlib window bits value for output with gzip headers
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def accepts_gzip(accept_encoding):
+    '''
+    Checks if the value of an Accept-Encoding header allows a gzip
+    compressed response
+    '''
+    if not accept_encoding:
+        return False
+
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        parts = coding.split(';')
+        name = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+
+    for name in ('gzip', 'x-gzip', '*'):
+        if name in qualities:
+            return qualities[name] > 0
+    return False
+
+
+def gzip_string(content, level=6):
+    '''
+    Returns the content compressed in gzip format
+    '''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(content) + compressor.flush()
+
+
+def iter_gzip(chunks, level=6):
+    '''
+    Compresses the chunks of content yielded by an iterator, yielding the
+    compressed data in gzip format as it becomes available
+    '''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def gzip_file(path, gzip_path, level=9):
+    '''
+    Writes a gzip compressed copy of a file
+    '''
+    with open(path, 'rb') as f_in:
+        f_out = gzip.open(gzip_path, 'wb', level)
+        try:
+            shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+        finally:
+            f_out.close()
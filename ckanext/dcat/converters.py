@@ -103,3 +103,34 @@ def ckan_to_dcat(package_dict):
         dcat_dict['distribution'].append(distribution)
 
     return dcat_dict
+
+
+# Resource fields used by ckan_to_dcat
+DISTRIBUTION_RESOURCE_FIELDS = ['name', 'description', 'format', 'size', 'url']
+
+
+def lean_result_to_package_dict(result, resources):
+    '''
+    Builds a minimal package dict, with the values used by ckan_to_dcat,
+    from a search index result and the list of resources of the dataset.
+
+    Fields without a value are not present on the index documents. Extras
+    can be either on an `extras` dict, as returned by the search query, or
+    still as `extras_*` fields, as stored on the index.
+    '''
+    package_dict = dict((key, result.get(key)) for key in
+                        ('id', 'metadata_modified', 'title', 'notes', 'url',
+                         'maintainer', 'maintainer_email'))
+
+    package_dict['tags'] = [{'name': tag} for tag in result.get('tags', [])]
+
+    extras = dict((key[len('extras_'):], value)
+                  for key, value in result.iteritems()
+                  if key.startswith('extras_'))
+    extras.update(result.get('extras', {}))
+    package_dict['extras'] = [{'key': key, 'value': value} for key, value
+                              in extras.iteritems()]
+
+    package_dict['resources'] = resources
+
+    return package_dict
@@ -1 +1,2 @@
 import xml
+import json_stream
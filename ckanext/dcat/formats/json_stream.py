@@ -0,0 +1,203 @@
+import re
+import json
+
+
+CHUNK_SIZE = 1024 * 64
+
+_WHITESPACE = re.compile(r'[^ \t\n\r]')
+_STRUCTURAL = re.compile(r'[\[\]{}"]')
+_STRING = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[,\]} \t\n\r]')
+
+
+class _Reader(object):
+    '''
+    Reads a JSON document in chunks from a file-like object, keeping in
+    memory only the part of it that is being scanned (or captured, from
+    `mark` onwards).
+    '''
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.mark = None
+        self.eof = False
+
+    def fill(self):
+        '''
+        Reads another chunk, discarding what is no longer needed. Returns
+        False if the end of the file was reached.
+        '''
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        keep = self.pos if self.mark is None else min(self.pos, self.mark)
+        self.buf = self.buf[keep:] + chunk
+        self.pos -= keep
+        if self.mark is not None:
+            self.mark -= keep
+        return True
+
+    def search(self, regex):
+        '''
+        Moves to the next match of the regex, and returns the matched
+        character, or None if the end of the file was reached.
+        '''
+        while True:
+            m = regex.search(self.buf, self.pos)
+            if m:
+                self.pos = m.start()
+                return self.buf[self.pos]
+            self.pos = len(self.buf)
+            if not self.fill():
+                return None
+
+    def peek(self):
+        '''
+        Returns the next non-whitespace character (without consuming it), or
+        None if the end of the file was reached.
+        '''
+        return self.search(_WHITESPACE)
+
+    def expect(self, chars):
+        char = self.peek()
+        if char is None or char not in chars:
+            raise ValueError('Expecting one of "{0}" at char {1}, found {2}'
+                             .format(chars, self.pos, char and repr(char)))
+        self.pos += 1
+        return char
+
+    def skip_string(self):
+        '''
+        Moves past the end of the string starting at the current position
+        '''
+        self.pos += 1
+        while True:
+            char = self.search(_STRING)
+            if char is None:
+                raise ValueError('Unterminated string')
+            if char == '"':
+                self.pos += 1
+                return
+            # Escaped character, make sure it is in the buffer
+            while self.pos + 1 >= len(self.buf):
+                if not self.fill():
+                    raise ValueError('Unterminated string')
+            self.pos += 2
+
+    def skip_value(self):
+        '''
+        Moves past the end of the JSON value starting at the current
+        position (ignoring whitespace)
+        '''
+        char = self.peek()
+        if char is None:
+            raise ValueError('Expecting value')
+        if char == '"':
+            self.skip_string()
+        elif char in '[{':
+            depth = 0
+            while True:
+                char = self.search(_STRUCTURAL)
+                if char is None:
+                    raise ValueError('Unexpected end of document')
+                if char == '"':
+                    self.skip_string()
+                    continue
+                elif char in '[{':
+                    depth += 1
+                else:
+                    depth -= 1
+                self.pos += 1
+                if depth == 0:
+                    return
+        elif char in ',:]}':
+            raise ValueError('Expecting value at char {0}'.format(self.pos))
+        else:
+            # Number, true, false or null
+            self.search(_SCALAR_END)
+
+    def read_value(self):
+        '''
+        Returns the raw text of the JSON value starting at the current
+        position (ignoring whitespace)
+        '''
+        self.peek()
+        self.mark = self.pos
+        try:
+            self.skip_value()
+            return self.buf[self.mark:self.pos]
+        finally:
+            self.mark = None
+
+
+def iter_datasets(f, chunk_size=CHUNK_SIZE):
+    '''
+    Incrementally parses a DCAT JSON document from the file-like object `f`,
+    and yields a tuple for each dataset with the parsed dict and its raw
+    text as it appears on the document.
+
+    The document can either be a list of datasets or an object with a
+    `dataset` key containing the list of datasets. Only one dataset is kept
+    in memory at a time.
+
+    Raises ValueError if the document has a different structure or is not
+    valid JSON.
+    '''
+    reader = _Reader(f, chunk_size)
+
+    # Skip the UTF-8 BOM if present
+    reader.peek()
+    if reader.buf.startswith('\xef\xbb\xbf', reader.pos):
+        reader.pos += 3
+
+    first = reader.peek()
+    if first == '[':
+        reader.pos += 1
+    elif first == '{':
+        reader.pos += 1
+        if not _find_datasets_key(reader):
+            return
+    else:
+        raise ValueError('Wrong JSON object')
+
+    # We are inside the list of datasets
+    if reader.peek() == ']':
+        return
+    while True:
+        raw = reader.read_value()
+        dataset = json.loads(raw)
+        if not isinstance(dataset, dict):
+            raise ValueError('Wrong JSON object')
+        yield dataset, raw
+        if reader.expect(',]') == ']':
+            return
+
+
+def _find_datasets_key(reader):
+    '''
+    Moves the reader to the start of the value of the `dataset` key of the
+    top level object, skipping all other keys. Returns False if there is no
+    such key.
+    '''
+    if reader.peek() == '}':
+        return False
+    while True:
+        if reader.peek() != '"':
+            raise ValueError('Expecting property name at char {0}'
+                             .format(reader.pos))
+        key = json.loads(reader.read_value())
+        reader.expect(':')
+        if key == 'dataset':
+            if reader.peek() != '[':
+                raise ValueError('Wrong JSON object')
+            reader.pos += 1
+            return True
+        reader.skip_value()
+        if reader.expect(',}') == '}':
+            return False
@@ -13,22 +13,36 @@ class MappedXmlDocument(MappedXmlObject):
 
     base_class = None
 
-    def __init__(self, xml_str=None, xml_tree=None, lang='en'):
+    def __init__(self, xml_str=None, xml_tree=None, lang='en', engine='xpath'):
+        '''`engine` can be 'xpath', to evaluate the search paths of each
+        element with XPath, or 'dispatch', to read all elements in a single
+        pass over the document children (see TagDispatcher).'''
         assert (xml_str or xml_tree is not None), 'Must provide some XML in one format or another'
+        assert engine in ('xpath', 'dispatch'), 'Unknown engine: {0}'.format(engine)
         self.xml_str = xml_str
         self.xml_tree = xml_tree
         self.lang = lang
+        self.engine = engine
 
     def read_values(self):
         '''For all of the elements listed, finds the values of them in the
         XML and returns them.'''
-        values = {}
         tree = self.get_xml_tree()
-        for element in self.elements:
-            values[element.name] = element.read_value(tree, self.lang)
+        if self.engine == 'dispatch':
+            values = self.get_dispatcher().read_values(tree, self.lang)
+        else:
+            values = {}
+            for element in self.elements:
+                values[element.name] = element.read_value(tree, self.lang)
         self.infer_values(values)
         return values
 
+    @classmethod
+    def get_dispatcher(cls):
+        if '_dispatcher' not in cls.__dict__:
+            cls._dispatcher = TagDispatcher(cls.elements)
+        return cls._dispatcher
+
     def read_value(self, name):
         '''For the given element name, find the value in the XML and return
         it.
@@ -73,6 +87,13 @@ class MappedXmlElement(MappedXmlObject):
         self.elements = elements or self.elements
         self.multilingual = multilingual
 
+        # Compile the search paths once, evaluating them is then much faster
+        self._xpaths = {}
+        for xpath in self.get_search_paths():
+            self.get_xpath(xpath)
+            if self.is_multilingual_xpath(xpath):
+                self.get_xpath(xpath, multilingual=True)
+
     def read_value(self, tree, lang=None):
         values = []
         for xpath in self.get_search_paths():
@@ -82,6 +103,11 @@ class MappedXmlElement(MappedXmlObject):
                 break
         return self.fix_multiplicity(values)
 
+    def get_dispatcher(self):
+        if getattr(self, '_dispatcher', None) is None:
+            self._dispatcher = TagDispatcher(self.elements)
+        return self._dispatcher
+
     def get_search_paths(self):
         if type(self.search_paths) != type([]):
             search_paths = [self.search_paths]
@@ -89,14 +115,28 @@ class MappedXmlElement(MappedXmlObject):
             search_paths = self.search_paths
         return search_paths
 
+    def is_multilingual_xpath(self, xpath):
+        return self.multilingual and xpath.endswith('/text()')
+
+    def get_xpath(self, xpath, multilingual=False):
+        '''Returns a compiled XPath evaluator for the expression.
+
+        If `multilingual` is True, the expression only selects values in the
+        language passed as the `lang` XPath variable.
+        '''
+        key = (xpath, multilingual)
+        if key not in self._xpaths:
+            if multilingual:
+                xpath = xpath.replace('/text()', '[@xml:lang=$lang]/text()')
+            self._xpaths[key] = etree.XPath(xpath, namespaces=self.namespaces)
+        return self._xpaths[key]
+
     def get_elements(self, tree, xpath, lang=None):
-        if xpath.endswith('/text()') and lang and self.multilingual:
-            xpath_lang = xpath.replace('/text()',
-                    '[@xml:lang="{0}"]/text()'.format(lang))
-            elements = tree.xpath(xpath_lang, namespaces=self.namespaces)
+        if lang and self.is_multilingual_xpath(xpath):
+            elements = self.get_xpath(xpath, multilingual=True)(tree, lang=lang)
             if elements:
                 return elements
-        return tree.xpath(xpath, namespaces=self.namespaces)
+        return self.get_xpath(xpath)(tree)
 
     def get_values(self, elements):
         values = []
@@ -164,6 +204,136 @@ class MappedXmlElement(MappedXmlObject):
             return values
 
 
+class TagDispatcher(object):
+    '''Reads the values of a list of elements in a single pass over the
+    children of an XML element.
+
+    The search paths of the elements are parsed once into a table that maps
+    the tag of the first step of each path to the elements that use it.
+    Reading the values then only iterates over the children once, looking
+    up their tags in the table, and follows the rest of the path (if any)
+    from the matching children.
+
+    Paths with the form `prefix:name/.../prefix:name` optionally ending in
+    `/text()` or `/@prefix:name`, plus `text()` and `@prefix:name`, are
+    supported. Elements with other search paths are read with XPath. The
+    search paths precedence, `multilingual` and `multiplicity` rules are the
+    same as for the XPath engine, and so are the values returned.
+    '''
+
+    XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+    def __init__(self, elements):
+        self.elements = elements
+        # Parsed search paths for each element, or None to use XPath
+        self.paths = []
+        # Tag of the first step -> list of ((element index, path index),
+        # rest of the steps, terminal)
+        self.table = {}
+        # Paths without steps, read from the element itself
+        self.direct = []
+
+        for i, element in enumerate(elements):
+            try:
+                paths = [self.parse_path(xpath, element.namespaces)
+                         for xpath in element.get_search_paths()]
+            except ValueError:
+                log.debug('Element %s will be read with XPath', element.name)
+                paths = None
+            self.paths.append(paths)
+            for j, (steps, terminal) in enumerate(paths or []):
+                if steps:
+                    self.table.setdefault(steps[0], []).append(
+                        ((i, j), steps[1:], terminal))
+                else:
+                    self.direct.append(((i, j), steps, terminal))
+
+    def parse_path(self, xpath, namespaces):
+        '''Returns a tuple with the list of tags of the path steps and its
+        terminal, which is 'text()', an attribute name or None if the path
+        selects elements. Raises ValueError if the path is not supported.'''
+        parts = xpath.split('/')
+        terminal = None
+        if parts[-1] == 'text()':
+            terminal = parts.pop()
+        elif parts[-1].startswith('@'):
+            terminal = self.parse_name(parts.pop()[1:], namespaces)
+        return [self.parse_name(part, namespaces) for part in parts], terminal
+
+    def parse_name(self, name, namespaces):
+        prefix, sep, local_name = name.partition(':')
+        if (not sep or not local_name or prefix not in namespaces or
+                not local_name.replace('_', '').replace('-', '').replace('.', '').isalnum()):
+            raise ValueError('Unsupported path step: {0}'.format(name))
+        return '{{{0}}}{1}'.format(namespaces[prefix], local_name)
+
+    def read_values(self, tree, lang=None):
+        # Nodes found for each (element index, path index), as (node, lang)
+        # tuples
+        found = {}
+
+        for key, steps, terminal in self.direct:
+            self.collect(tree, steps, terminal, found.setdefault(key, []))
+
+        table = self.table
+        for child in tree.iterchildren(tag=etree.Element):
+            entries = table.get(child.tag)
+            if entries:
+                for key, steps, terminal in entries:
+                    self.collect(child, steps, terminal,
+                                 found.setdefault(key, []))
+
+        values = {}
+        for i, element in enumerate(self.elements):
+            paths = self.paths[i]
+            if paths is None:
+                values[element.name] = element.read_value(tree, lang)
+                continue
+            element_values = []
+            for j, (steps, terminal) in enumerate(paths):
+                nodes = found.get((i, j))
+                if not nodes:
+                    continue
+                if lang and element.multilingual and steps and \
+                        terminal == 'text()':
+                    lang_nodes = [node for node in nodes if node[1] == lang]
+                    if lang_nodes:
+                        nodes = lang_nodes
+                element_values = [self.get_value(element, node)
+                                  for node, node_lang in nodes]
+                break
+            values[element.name] = element.fix_multiplicity(element_values)
+        return values
+
+    def collect(self, node, steps, terminal, found):
+        '''Appends to `found` the nodes matching the rest of the path from
+        the given element, in document order.'''
+        if steps:
+            for child in node.iterchildren(steps[0]):
+                self.collect(child, steps[1:], terminal, found)
+        elif terminal is None:
+            found.append((node, None))
+        elif terminal == 'text()':
+            node_lang = node.get(self.XML_LANG)
+            if node.text is not None:
+                found.append((node.text, node_lang))
+            for child in node:
+                if child.tail is not None:
+                    found.append((child.tail, node_lang))
+        else:
+            value = node.get(terminal)
+            if value is not None:
+                found.append((value, None))
+
+    def get_value(self, element, node):
+        if element.elements:
+            return element.get_dispatcher().read_values(node)
+        elif isinstance(node, basestring):
+            return node
+        else:
+            return element.element_tostring(node)
+
+
 class DCATElement(MappedXmlElement):
 
     namespaces = {
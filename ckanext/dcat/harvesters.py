@@ -1,10 +1,17 @@
 #coding: utf-8
 
 import os
+import mmap
+import datetime
 import uuid
 import json
 import logging
+import tempfile
+import contextlib
 from hashlib import sha1
+from collections import namedtuple
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
 try:
     from cStringIO import StringIO
@@ -12,79 +19,569 @@ except ImportError:
     from StringIO import StringIO
 
 from lxml import etree
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import aliased
+from sqlalchemy.exc import IntegrityError
 import requests
+import requests.adapters
+from pylons import config
 
 from ckan import plugins as p
 from ckan import logic
 from ckan import model
+from ckan.lib import search
+from ckan.lib.munge import munge_title_to_name
 
 from ckanext.harvest.harvesters import HarvesterBase
-from ckanext.harvest.model import HarvestObject, HarvestObjectExtra
+from ckanext.harvest.model import (HarvestJob, HarvestObject, HarvestObjectExtra,
+                                   HarvestObjectError)
 
 from ckanext.dcat import converters, formats
+from ckanext.dcat.cache import MemoryCache
+from ckanext.dcat import model as dcat_model
+from ckanext.dcat.model import (setup as model_setup, DCATHarvestPage,
+                                DCATPendingIndex, DCATNameReservation)
 
 log = logging.getLogger(__name__)
 
+
+# Details of a harvest object of a job, loaded for all of them at once
+_PreloadedObject = namedtuple('_PreloadedObject', [
+    'current_id', 'package_name', 'package_title', 'status', 'content_format'])
+
+
+class ContentBuffer(object):
+    '''
+    Buffer for the contents of a remote or local file
+
+    Chunks are appended in linear time to a spooled temporary file, which is
+    kept in memory until it grows bigger than `spool_size` bytes and written
+    to disk afterwards (a `spool_size` of 0 keeps it always in memory). Once
+    all chunks have been written, contents on disk are memory-mapped so the
+    parsers can read them without loading another full copy in memory.
+
+    A SHA1 digest of the contents is computed as chunks are written. The
+    HTTP validators of the response, if any, are stored in `etag` and
+    `last_modified`, and `not_modified` is set when the server responded
+    with a 304 to a conditional request (in which case the buffer is empty).
+    '''
+
+    def __init__(self, spool_size=0):
+        self.spool_size = spool_size
+        self.length = 0
+        self.etag = None
+        self.last_modified = None
+        self.not_modified = False
+        self._hash = sha1()
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self._mmap = None
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._hash.update(chunk)
+        self.length += len(chunk)
+
+    @property
+    def digest(self):
+        return self._hash.hexdigest()
+
+    def open(self):
+        '''
+        Returns a file-like object to read the contents from the start
+        '''
+        if self._mmap is None and self.spool_size and \
+                self.length > self.spool_size:
+            self._file.flush()
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        f = self._mmap if self._mmap is not None else self._file
+        f.seek(0)
+        return f
+
+    def getvalue(self):
+        return self.open().read(self.length)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __len__(self):
+        return self.length
+
+
+def _open_content(content):
+    '''
+    Returns a file-like object for a ContentBuffer or a string
+    '''
+    if isinstance(content, basestring):
+        return StringIO(content)
+    return content.open()
+
+
+def _read_content(content):
+    '''
+    Returns the contents of a ContentBuffer or a string as a string
+    '''
+    if isinstance(content, basestring):
+        return content
+    return content.getvalue()
+
+
+@contextlib.contextmanager
+def _config_override(key, value):
+    '''
+    Sets a config option to the given value inside the block
+    '''
+    previous = config.get(key)
+    config[key] = value
+    try:
+        yield
+    finally:
+        if previous is None:
+            del config[key]
+        else:
+            config[key] = previous
+
+
+def _automatic_indexing_disabled():
+    '''
+    Stops CKAN from indexing the datasets that are created or updated inside
+    the block when the changes are committed (via the
+    `ckan.search.automatic_indexing` config option)
+    '''
+    return _config_override('ckan.search.automatic_indexing', False)
+
+
+def _index_packages(package_ids):
+    '''
+    Indexes the given datasets with a single search commit. Datasets that
+    are deleted or do not exist anymore are removed from the index (with
+    `ckan.search.solr_commit` disabled, so that does not commit either).
+    '''
+    package_index = search.index_for(model.Package)
+    context = {'model': model, 'ignore_auth': True, 'validate': False,
+               'use_cache': False}
+
+    with _config_override('ckan.search.solr_commit', 'false'):
+        for package_id in package_ids:
+            try:
+                package_dict = p.toolkit.get_action('package_show')(
+                    dict(context), {'id': package_id})
+            except logic.NotFound:
+                log.warning('Dataset {0} pending to be indexed does not '
+                            'exist anymore'.format(package_id))
+                package_index.delete_package({'id': package_id})
+                continue
+            # Deleted datasets are removed from the index
+            package_index.update_dict(package_dict, defer_commit=True)
+
+    search.commit()
+
+
+def index_pending_packages(batch_size=1000):
+    '''
+    Indexes the datasets that were created, updated or deleted by harvest
+    jobs with deferred indexing, `batch_size` datasets at a time, with a
+    single search commit for each batch. Deleted datasets are removed from
+    the index.
+
+    Datasets are only removed from the pending list once they have been
+    indexed, so if indexing fails it can be run again later. Returns the
+    number of datasets indexed.
+    '''
+    model_setup()
+
+    total = 0
+    while True:
+        package_ids = [row.package_id for row in
+                       model.Session.query(DCATPendingIndex.package_id)
+                                    .order_by(DCATPendingIndex.created)
+                                    .limit(batch_size)]
+        if not package_ids:
+            break
+
+        _index_packages(package_ids)
+
+        model.Session.query(DCATPendingIndex) \
+                     .filter(DCATPendingIndex.package_id.in_(package_ids)) \
+                     .delete(synchronize_session=False)
+        model.Session.commit()
+
+        total += len(package_ids)
+        log.info('Indexed {0} datasets pending to be indexed'.format(total))
+
+    return total
+
+
+def _import_worker(args):
+    '''
+    Imports a batch of harvest objects on a worker process of
+    `DCATHarvester.import_job`. Returns the number of objects imported
+    successfully and the number of errors.
+    '''
+    harvester_class, user_name, force_import, object_ids = args
+
+    harvester = harvester_class()
+    harvester._user_name = user_name
+    harvester.force_import = force_import
+    # Names must be reserved, as other workers are creating datasets at the
+    # same time
+    harvester._reserve_names = True
+    try:
+        harvest_objects = model.Session.query(HarvestObject) \
+                          .filter(HarvestObject.id.in_(object_ids)) \
+                          .all()
+        results = harvester.import_batch(harvest_objects)
+        return results.count(True), len(results) - results.count(True)
+    except Exception, e:
+        log.exception(e)
+        model.Session.rollback()
+        return 0, len(object_ids)
+    finally:
+        model.Session.remove()
+
+
+class PageFetcher(object):
+    '''
+    Gets the contents of the consecutive pages of a harvest source
+
+    If `prefetch` is greater than 0, up to that number of pages after the
+    one requested are fetched in advance on a pool of threads, so network
+    requests overlap with the processing of the current page. Pages are
+    still returned in order, and errors are saved on the job from the main
+    thread when the page is requested. Prefetching only starts once the
+    second page is known to be different from the first one, so sources
+    without pagination are not downloaded more times than needed.
+
+    `page_states` is an optional dict of page URLs to DCATHarvestPage
+    objects, used to do conditional requests.
+
+    `close` must be called once done.
+    '''
+
+    def __init__(self, harvester, url, harvest_job, prefetch=0,
+                 page_states=None):
+        self.harvester = harvester
+        self.url = url
+        self.harvest_job = harvest_job
+        self.prefetch = prefetch
+        self.page_states = page_states or {}
+        self._pending = {}
+        self._pool = None
+        self._first_digest = None
+        self._paginated = False
+        if prefetch > 0:
+            # Make sure the session is not created from the threads
+            harvester._get_session()
+            self._pool = ThreadPool(prefetch)
+
+    def get_page_state(self, page):
+        return self.page_states.get(self.harvester._get_page_url(self.url,
+                                                                 page))
+
+    def get_content(self, page):
+        '''
+        Returns the ContentBuffer for the page, or None if there was an
+        error. A 404 after the first page is raised as an HTTPError.
+        '''
+        if not self._pool or not self._paginated:
+            content = self.harvester._get_content(self.url, self.harvest_job,
+                                                  page, self.get_page_state(page))
+            if content is not None and page <= 2:
+                self._check_paginated(page, content)
+            return content
+
+        for next_page in xrange(page, page + self.prefetch + 1):
+            if next_page not in self._pending:
+                self._pending[next_page] = self._pool.apply_async(
+                    self.harvester._fetch_content,
+                    (self.url, next_page, self.get_page_state(next_page)))
+
+        content, error = self._pending.pop(page).get()
+        if error:
+            self.harvester._save_gather_error(error, self.harvest_job)
+        return content
+
+    def _check_paginated(self, page, content):
+        '''
+        Compares the digests of the first two pages to find out if the
+        source is paginated
+        '''
+        if content.not_modified:
+            page_state = self.get_page_state(page)
+            digest = page_state.digest if page_state else None
+        else:
+            digest = content.digest
+
+        if page == 1:
+            self._first_digest = digest
+        elif digest != self._first_digest:
+            self._paginated = True
+
+    def close(self):
+        if not self._pool:
+            return
+        self._pool.terminate()
+        for result in self._pending.values():
+            if result.ready() and result.successful():
+                content, error = result.get()
+                if content is not None:
+                    content.close()
+        self._pending = {}
+
+
+class NameAllocator(object):
+    '''
+    Generates names for new datasets the same way
+    `HarvesterBase._gen_new_name` does (the title munged, or if that name is
+    in use, with a random suffix), without querying the database for each
+    one of them.
+
+    Whether the munged titles are in use is loaded in bulk, and the names
+    given are reserved in memory, so they are not given again during the
+    job.
+    '''
+
+    # Number of names checked on each query
+    LOAD_BATCH_SIZE = 500
+
+    def __init__(self):
+        self.taken = set()
+        self.loaded = set()
+
+    def slug(self, title):
+        name = munge_title_to_name(title).replace('_', '-')
+        while '--' in name:
+            name = name.replace('--', '-')
+        return name
+
+    def load(self, titles):
+        '''
+        Loads which of the munged versions of the titles provided are names
+        in use. Like `_gen_new_name`, only the exact names are checked.
+        '''
+        slugs = list(set(self.slug(title) for title in titles if title)
+                     - self.loaded)
+        for i in xrange(0, len(slugs), self.LOAD_BATCH_SIZE):
+            batch = slugs[i:i + self.LOAD_BATCH_SIZE]
+            query = model.Session.query(model.Package.name) \
+                         .filter(model.Package.name.in_(batch))
+            self.taken.update(row.name for row in query)
+            self.loaded.update(batch)
+
+    def allocate(self, title):
+        '''
+        Returns a name for a new dataset with the given title that is not in
+        use, and reserves it
+        '''
+        name = self.slug(title)
+        if not name:
+            return name
+        if name not in self.loaded:
+            self.load([title])
+
+        if name in self.taken:
+            candidate = name + str(uuid.uuid4())[:5]
+            while candidate in self.taken:
+                candidate = name + str(uuid.uuid4())[:5]
+            name = candidate
+
+        self.taken.add(name)
+        return name
+
+
 class DCATHarvester(HarvesterBase):
 
 
     MAX_FILE_SIZE = 1024 * 1024 * 50 # 50 Mb
-    CHUNK_SIZE = 1024
+    CHUNK_SIZE = 1024 * 64
+    SPOOL_SIZE = 1024 * 1024 * 5 # 5 Mb
 
 
+    # Number of jobs (and seconds) the details loaded for the objects of a
+    # job are kept in memory for. Objects of jobs running at the same time
+    # arrive interleaved from the harvest queue.
+    JOB_CACHE_SIZE = 8
+    JOB_CACHE_TTL = 60 * 60 * 24
+
     force_import = False
 
     _user_name = None
 
-    def _get_content(self, url, harvest_job, page=1):
+    _session = None
+    _pending_index_count = 0
+    _reserve_names = False
+    # Whether `_get_title_hint` can read the title from the original content
+    # of the objects, and not only from the dcat dict extracted on the gather
+    # stage
+    _titles_in_original_content = False
+    _job_preload = None
+    _name_allocators = None
+
+    def _get_session(self):
+        '''
+        Returns the requests Session used by this harvester
+
+        The session is kept between pages and jobs so connections to the
+        remote servers are pooled and reused. The pool size and the number of
+        retries on connection errors can be set with the
+        `ckanext.dcat.harvest.pool_size` and `ckanext.dcat.harvest.retries`
+        config options.
+        '''
+        if self._session:
+            return self._session
+
+        pool_size = int(config.get('ckanext.dcat.harvest.pool_size', 10))
+        retries = int(config.get('ckanext.dcat.harvest.retries', 3))
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size,
+                                                max_retries=retries)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        self._session = session
+
+        return self._session
+
+    def _get_timeout(self):
+        '''
+        Returns the timeout in seconds for the remote requests, set with the
+        `ckanext.dcat.harvest.timeout` config option
+        '''
+        return int(config.get('ckanext.dcat.harvest.timeout', 60))
+
+    def _get_max_file_size(self):
+        '''
+        Returns the maximum size in bytes of a remote file, set with the
+        `ckanext.dcat.harvest.max_file_size` config option
+        '''
+        return int(config.get('ckanext.dcat.harvest.max_file_size',
+                              self.MAX_FILE_SIZE))
+
+    def _get_content_buffer(self):
+        '''
+        Returns an empty ContentBuffer, spilling to disk after the number of
+        bytes set in the `ckanext.dcat.harvest.spool_size` config option
+        '''
+        spool_size = int(config.get('ckanext.dcat.harvest.spool_size',
+                                    self.SPOOL_SIZE))
+        return ContentBuffer(spool_size)
+
+    def _get_chunk_size(self):
+        return int(config.get('ckanext.dcat.harvest.chunk_size',
+                              self.CHUNK_SIZE))
+
+    def _get_conditional_requests(self):
+        '''
+        Whether the validators and digest of each page of the source should
+        be stored and used on the next job to find out if the source has
+        changed, set with the `ckanext.dcat.harvest.conditional_requests`
+        config option
+        '''
+        return p.toolkit.asbool(
+            config.get('ckanext.dcat.harvest.conditional_requests', False))
+
+    def _get_page_url(self, url, page):
+        if page > 1:
+            url = url + '&' if '?' in url else url + '?'
+            url = url + 'page={0}'.format(page)
+        return url
+
+    def _get_prefetch_pages(self):
+        '''
+        Number of pages of a source that are requested in advance while the
+        current one is being processed, set with the
+        `ckanext.dcat.harvest.prefetch_pages` config option (default 0, no
+        prefetching)
+        '''
+        return int(config.get('ckanext.dcat.harvest.prefetch_pages', 0))
+
+    def _get_content(self, url, harvest_job, page=1, page_state=None):
+        '''
+        Returns a ContentBuffer with the contents of the given page of a
+        remote or local file, or None if there was an error getting them.
+
+        If `page_state` (a DCATHarvestPage) is provided, a conditional
+        request is done with its validators.
+        '''
+        content, error = self._fetch_content(url, page, page_state)
+        if error:
+            self._save_gather_error(error, harvest_job)
+        return content
+
+    def _fetch_content(self, url, page=1, page_state=None):
+        '''
+        Gets the contents of the given page of a remote or local file.
+
+        Returns a tuple with a ContentBuffer and None, or None and an error
+        message. A 404 after the first page is raised as an HTTPError.
+
+        This does not touch the database so it can be called from other
+        threads.
+        '''
         if not url.lower().startswith('http'):
             # Check local file
             if os.path.exists(url):
-                with open(url, 'r') as f:
-                    content = f.read()
-                return content
+                content = self._get_content_buffer()
+                chunk_size = self._get_chunk_size()
+                with open(url, 'rb') as f:
+                    for chunk in iter(lambda: f.read(chunk_size), ''):
+                        content.write(chunk)
+                return content, None
             else:
-                self._save_gather_error('Could not get content for this url', harvest_job)
-                return None
+                return None, 'Could not get content for this url'
 
         try:
-            if page > 1:
-                url = url + '&' if '?' in url else url + '?'
-                url = url + 'page={0}'.format(page)
+            url = self._get_page_url(url, page)
 
+            headers = {}
+            if page_state:
+                if page_state.etag:
+                    headers['If-None-Match'] = page_state.etag
+                if page_state.last_modified:
+                    headers['If-Modified-Since'] = page_state.last_modified
 
             log.debug('Getting file %s', url)
 
-            # first we try a HEAD request which may not be supported
-            did_get = False
-            r = requests.head(url)
-            if r.status_code == 405:
-                r = requests.get(url, stream=True)
-                did_get = True
-            r.raise_for_status()
-
-            cl = r.headers['content-length']
-            if cl and int(cl) > self.MAX_FILE_SIZE:
-                msg = '''Remote file is too big. Allowed
-                    file size: {allowed}, Content-Length: {actual}.'''.format(
-                    allowed=self.MAX_FILE_SIZE, actual=cl)
-                self._save_gather_error(msg, harvest_job)
-                return None
-
-            if not did_get:
-                r = requests.get(url, stream=True)
-
-            length = 0
-            content = ''
-            for chunk in r.iter_content(chunk_size=self.CHUNK_SIZE):
-                content = content + chunk
-                length += len(chunk)
-
-                if length >= self.MAX_FILE_SIZE:
-                    self._save_gather_error('Remote file is too big.', harvest_job)
-                    return None
+            # A single streamed GET, the size limit is checked both against
+            # the Content-Length header (if present) and the actual bytes read
+            max_file_size = self._get_max_file_size()
 
-            return content
+            r = self._get_session().get(url, stream=True, headers=headers,
+                                        timeout=self._get_timeout())
+            try:
+                if r.status_code == 304:
+                    content = self._get_content_buffer()
+                    content.not_modified = True
+                    return content, None
+
+                r.raise_for_status()
+
+                cl = r.headers.get('content-length')
+                if cl and int(cl) > max_file_size:
+                    msg = '''Remote file is too big. Allowed
+                        file size: {allowed}, Content-Length: {actual}.'''.format(
+                        allowed=max_file_size, actual=cl)
+                    return None, msg
+
+                content = self._get_content_buffer()
+                content.etag = r.headers.get('etag')
+                content.last_modified = r.headers.get('last-modified')
+                for chunk in r.iter_content(chunk_size=self._get_chunk_size()):
+                    content.write(chunk)
+
+                    if len(content) >= max_file_size:
+                        content.close()
+                        return None, 'Remote file is too big.'
+
+                return content, None
+            finally:
+                # Release the connection back to the pool (or discard it if
+                # the body was not fully read)
+                r.close()
 
         except requests.exceptions.HTTPError, error:
             if page > 1 and error.response.status_code == 404:
@@ -93,17 +590,14 @@ class DCATHarvester(HarvesterBase):
 
             msg = 'Could not get content. Server responded with %s %s' % (
                 error.response.status_code, error.response.reason)
-            self._save_gather_error(msg, harvest_job)
-            return None
+            return None, msg
         except requests.exceptions.ConnectionError, error:
             msg = '''Could not get content because a
                                 connection error occurred. %s''' % error
-            self._save_gather_error(msg, harvest_job)
-            return None
+            return None, msg
         except requests.exceptions.Timeout, error:
             msg = 'Could not get content because the connection timed out.'
-            self._save_gather_error(msg, harvest_job)
-            return None
+            return None, msg
 
 
     def _get_user_name(self):
@@ -125,18 +619,447 @@ class DCATHarvester(HarvesterBase):
                 return extra.value
         return None
 
-    def _get_package_name(self, harvest_object, title):
+    def _get_parse_in_gather(self):
+        '''
+        Whether the dcat dict of each dataset should be extracted on the
+        gather stage and stored as the harvest object content, set with the
+        `ckanext.dcat.harvest.parse_in_gather` config option
+        '''
+        return p.toolkit.asbool(
+            config.get('ckanext.dcat.harvest.parse_in_gather', False))
+
+    def _get_keep_raw_content(self):
+        '''
+        Whether the original content of each dataset should be kept in the
+        `raw_content` harvest object extra when the dcat dict is extracted on
+        the gather stage, set with the `ckanext.dcat.harvest.keep_raw_content`
+        config option
+        '''
+        return p.toolkit.asbool(
+            config.get('ckanext.dcat.harvest.keep_raw_content', False))
+
+    def _get_guids_and_dcat_dicts(self, content):
+        '''
+        Like `_get_guids_and_datasets`, but yields a tuple with the guid, the
+        original content and the dcat dict of each dataset. The dcat dict can
+        be None if it could not be extracted, in which case the original
+        content is imported as usual.
+        '''
+        for guid, as_string in self._get_guids_and_datasets(content):
+            yield guid, as_string, None
+
+    def _get_content_format(self, harvest_object):
+        '''
+        Returns the value of the `content_format` extra of a harvest object,
+        'dcat_dict' if its content is the dcat dict extracted on the gather
+        stage, or None if it is the original content
+        '''
+        preloaded = self._get_preloaded_object(harvest_object)
+        if preloaded is not None:
+            return preloaded.content_format
+        return self._get_object_extra(harvest_object, 'content_format')
+
+    def _dump_dcat_dict(self, dcat_dict):
+        '''
+        Returns the normalized, compact JSON form of a dcat dict that is
+        stored as the harvest object content
+        '''
+        return json.dumps(dcat_dict, sort_keys=True, separators=(',', ':'))
+
+    def _get_defer_indexing(self):
+        '''
+        Whether datasets created, updated or deleted on the import stage
+        should be indexed in bulk instead of one at a time, set with the
+        `ckanext.dcat.harvest.defer_indexing` config option
+        '''
+        return p.toolkit.asbool(
+            config.get('ckanext.dcat.harvest.defer_indexing', False))
+
+    def _get_index_batch_size(self):
+        '''
+        Number of datasets indexed at once when indexing is deferred, set
+        with the `ckanext.dcat.harvest.index_batch_size` config option
+        '''
+        return int(config.get('ckanext.dcat.harvest.index_batch_size', 1000))
+
+    def _index_deferred(self, job_id):
+        '''
+        Indexes the datasets pending to be indexed once there are
+        `index_batch_size` of them, or if there are no more objects of the
+        job waiting to be imported. Callers must have committed the final
+        state of the objects they imported, so when the last objects of a
+        job are imported at the same time by different consumers, the last
+        one to commit sees no objects left.
+        Indexing errors are logged, the datasets are kept as pending.
+        '''
+        if self._pending_index_count < self._get_index_batch_size():
+            query = model.Session.query(HarvestObject.id) \
+                        .filter(HarvestObject.harvest_job_id==job_id) \
+                        .filter(HarvestObject.state.in_(['WAITING', 'FETCH', 'IMPORT']))
+            if query.first():
+                return
+
+        self._pending_index_count = 0
+        try:
+            index_pending_packages(self._get_index_batch_size())
+        except Exception, e:
+            log.exception(e)
+            log.error('Could not index the pending datasets, run '
+                      '`paster dcat reindex_pending` to index them')
+
+    def _get_import_workers(self):
+        '''
+        Default number of processes that import the harvest objects of a job
+        in parallel with `paster dcat import`, set with the
+        `ckanext.dcat.harvest.import_workers` config option (default 0, a
+        single one)
+        '''
+        return int(config.get('ckanext.dcat.harvest.import_workers', 0))
+
+    def _get_import_batch_size(self):
+        '''
+        Number of harvest objects imported on each transaction by the import
+        workers, set with the `ckanext.dcat.harvest.import_batch_size` config
+        option
+        '''
+        return int(config.get('ckanext.dcat.harvest.import_batch_size', 100))
+
+    def _get_preload_objects(self):
+        '''
+        Whether the details needed to import the objects of a job should be
+        loaded for all of them with a single query, set with the
+        `ckanext.dcat.harvest.preload_objects` config option
+        '''
+        return p.toolkit.asbool(
+            config.get('ckanext.dcat.harvest.preload_objects', False))
+
+    def _preload_job_objects(self, harvest_job_id):
+        '''
+        Returns a dict with the guids of all the objects of a job as keys,
+        and a _PreloadedObject as values, with the id of the current object
+        for the same guid, the name and title of its dataset and the values
+        of the `status` and `content_format` extras.
+        '''
+        current = aliased(HarvestObject)
+        status = aliased(HarvestObjectExtra)
+        content_format = aliased(HarvestObjectExtra)
+
+        query = model.Session.query(HarvestObject.guid, current.id,
+                                    model.Package.name, model.Package.title,
+                                    status.value, content_format.value) \
+                             .outerjoin(current, and_(
+                                 current.guid==HarvestObject.guid,
+                                 current.current==True,
+                                 current.id!=HarvestObject.id)) \
+                             .outerjoin(model.Package,
+                                        model.Package.id==HarvestObject.package_id) \
+                             .outerjoin(status, and_(
+                                 status.harvest_object_id==HarvestObject.id,
+                                 status.key=='status')) \
+                             .outerjoin(content_format, and_(
+                                 content_format.harvest_object_id==HarvestObject.id,
+                                 content_format.key=='content_format')) \
+                             .filter(HarvestObject.harvest_job_id==harvest_job_id)
+
+        return dict((row[0], _PreloadedObject(*row[1:])) for row in query)
+
+    def _get_preloaded_object(self, harvest_object):
+        '''
+        Returns the preloaded details of a harvest object, or None if
+        preloading is disabled. The objects of the last `JOB_CACHE_SIZE`
+        jobs seen are kept in memory.
+        '''
+        if not self._get_preload_objects():
+            return None
+
+        if self._job_preload is None:
+            self._job_preload = MemoryCache(self.JOB_CACHE_SIZE,
+                                            self.JOB_CACHE_TTL)
+
+        job_id = harvest_object.harvest_job_id
+        job_objects = self._job_preload.get(job_id)
+        if job_objects is None:
+            job_objects = self._preload_job_objects(job_id)
+            self._job_preload.set(job_id, job_objects)
+            log.debug('Preloaded {0} objects of job {1}'.format(
+                      len(job_objects), job_id))
+
+        return job_objects.get(harvest_object.guid)
+
+    def _get_allocate_names(self):
+        '''
+        Whether names for new datasets should be generated with a
+        NameAllocator for each job, set with the
+        `ckanext.dcat.harvest.allocate_names` config option
+        '''
+        return p.toolkit.asbool(
+            config.get('ckanext.dcat.harvest.allocate_names', False))
+
+    def _get_name_allocator(self, harvest_job_id, load_job=False):
+        '''
+        Returns the NameAllocator of a job. The ones of the last
+        `JOB_CACHE_SIZE` jobs seen are kept in memory.
+
+        With `load_job`, a new allocator loads the names for the titles of
+        all the objects of the job that create a dataset (see
+        `_load_job_titles`).
+        '''
+        if self._name_allocators is None:
+            self._name_allocators = MemoryCache(self.JOB_CACHE_SIZE,
+                                                self.JOB_CACHE_TTL)
+
+        allocator = self._name_allocators.get(harvest_job_id)
+        if allocator is None:
+            self._release_finished_job_names()
+            allocator = NameAllocator()
+            if load_job:
+                self._load_job_titles(allocator, harvest_job_id)
+            self._name_allocators.set(harvest_job_id, allocator)
+        return allocator
+
+    def _load_job_titles(self, allocator, harvest_job_id):
+        '''
+        Loads on the allocator the names for the titles known in advance of
+        the objects of a job that create a dataset, so objects imported one
+        at a time do not need a query each. Unless the titles can be read
+        from the original content, only the objects with the dcat dict as
+        content are loaded.
+        '''
+        status = aliased(HarvestObjectExtra)
+        content_format = aliased(HarvestObjectExtra)
+
+        format_join = and_(
+            content_format.harvest_object_id==HarvestObject.id,
+            content_format.key=='content_format')
+
+        query = model.Session.query(HarvestObject.content,
+                                    content_format.value) \
+                             .join(status, and_(
+                                 status.harvest_object_id==HarvestObject.id,
+                                 status.key=='status',
+                                 status.value=='new')) \
+                             .filter(HarvestObject.harvest_job_id==harvest_job_id)
+        if self._titles_in_original_content:
+            query = query.outerjoin(content_format, format_join)
+        else:
+            query = query.join(content_format, and_(
+                format_join, content_format.value=='dcat_dict'))
+
+        allocator.load(self._get_title_hint(content, format_value) for
+                       content, format_value in
+                       query.yield_per(allocator.LOAD_BATCH_SIZE))
+
+    def _get_title_hint(self, content, content_format):
+        '''
+        Returns the title of the dataset of a harvest object, given its
+        content and content format, if it can be known without mapping it
+        (ie it was already extracted on the gather stage), or None otherwise
+        '''
+        if content_format != 'dcat_dict' or not content:
+            return None
+        try:
+            return json.loads(content).get('title')
+        except ValueError:
+            return None
+
+    def _get_gather_batch_size(self):
+        '''
+        Number of harvest objects saved at once on the gather stage, set with
+        the `ckanext.dcat.harvest.gather_batch_size` config option
+        '''
+        return int(config.get('ckanext.dcat.harvest.gather_batch_size', 500))
+
+    def _save_objects(self, objects, ids):
+        '''
+        Adds the pending harvest objects (and their extras) to the session
+        with a single flush, appends their ids to `ids` and empties the
+        `objects` list.
+        '''
+        if not objects:
+            return
+        model.Session.add_all(objects)
+        model.Session.flush()
+        ids.extend(obj.id for obj in objects)
+        del objects[:]
+
+    def _get_content_hash(self, content):
+        '''
+        Returns a digest of the contents of a harvest object, used to find
+        out if a dataset has changed since the last time it was harvested
+        '''
+        if isinstance(content, unicode):
+            content = content.encode('utf8')
+        return sha1(content).hexdigest()
+
+    def _get_package_name(self, harvest_object, title, preloaded=None):
 
-        package = harvest_object.package
-        if package is None or package.title != title:
-            name = self._gen_new_name(title)
+        if preloaded is not None:
+            package_name = preloaded.package_name
+            package_title = preloaded.package_title
+        else:
+            package = harvest_object.package
+            package_name = package.name if package else None
+            package_title = package.title if package else None
+
+        if package_name is None or package_title != title:
+            if self._get_allocate_names():
+                name = self._get_name_allocator(harvest_object.harvest_job_id,
+                                                load_job=True).allocate(title)
+            else:
+                name = self._gen_new_name(title)
             if not name:
                 raise Exception('Could not generate a unique name from the title or the GUID. Please choose a more unique title.')
+            if self._reserve_names or self._get_allocate_names():
+                # Other import workers or consumers may be giving the same
+                # name, as allocators only know about their own names
+                name = self._reserve_name(name, harvest_object.harvest_job_id)
         else:
-            name = package.name
+            name = package_name
 
         return name
 
+    def _reserve_name(self, name, job_id):
+        '''
+        Claims a dataset name for the job, and returns it. If the name was
+        already claimed by another import worker, a random suffix is added to
+        it, as `_gen_new_name` does with names already in use.
+
+        The reservation is committed straight away on its own connection, so
+        it is visible to all workers.
+        '''
+        candidate = name
+        while True:
+            try:
+                model.meta.engine.execute(
+                    dcat_model.dcat_name_reservation_table.insert(),
+                    name=candidate, harvest_job_id=job_id)
+                return candidate
+            except IntegrityError:
+                candidate = name + str(uuid.uuid4())[:5]
+
+    def _release_finished_job_names(self):
+        '''
+        Removes the names reserved by harvest jobs that have finished, as
+        their datasets have already been created
+        '''
+        finished_jobs = model.Session.query(HarvestJob.id) \
+                             .filter(HarvestJob.status=='Finished')
+        model.Session.query(DCATNameReservation) \
+                     .filter(DCATNameReservation.harvest_job_id.in_(finished_jobs.subquery())) \
+                     .delete(synchronize_session=False)
+
+    def _source_unchanged(self, url, harvest_job):
+        '''
+        Checks if the source has changed since the last harvest job, doing
+        conditional requests for all the pages stored on the last job.
+
+        Returns True if all pages are unchanged (the server responded with a
+        304 or the contents digest is the same), False if any of them
+        changed or there are new or removed pages, and None if there was an
+        error getting the contents.
+
+        The source is also considered changed if any object of the last job
+        was not imported successfully, so those datasets are retried.
+        '''
+        query = model.Session.query(DCATHarvestPage).\
+                    filter(DCATHarvestPage.harvest_source_id==harvest_job.source.id)
+        stored_pages = dict((page_state.url, page_state) for page_state in query)
+        if not stored_pages:
+            return False
+
+        if not self._previous_job_complete(harvest_job):
+            log.debug('The last job of the source did not import all its '
+                      'objects')
+            return False
+
+        fetcher = PageFetcher(self, url, harvest_job,
+                              self._get_prefetch_pages(), stored_pages)
+        try:
+            unchanged_pages = 0
+            previous_digest = None
+            page = 1
+            while True:
+                page_state = fetcher.get_page_state(page)
+                try:
+                    content = fetcher.get_content(page)
+                except requests.exceptions.HTTPError:
+                    # 404 after the first page, no more pages
+                    break
+
+                if content is None:
+                    return None
+
+                try:
+                    if content.not_modified:
+                        digest = page_state.digest
+                    else:
+                        digest = content.digest
+
+                    if previous_digest == digest:
+                        # Same content, no more pages. Sources without
+                        # pagination have their repeated page stored too.
+                        if page_state is not None:
+                            if page_state.digest != digest:
+                                return False
+                            unchanged_pages += 1
+                        break
+
+                    if page_state is None and not content.not_modified:
+                        # This can be the empty page that ends the source
+                        try:
+                            empty = not any(True for dataset in
+                                            self._get_guids_and_datasets(content))
+                        except ValueError:
+                            return False
+                        if empty:
+                            break
+
+                    if page_state is None or digest != page_state.digest:
+                        log.debug('Page {0} has changed'.format(page))
+                        return False
+                finally:
+                    content.close()
+
+                unchanged_pages += 1
+                previous_digest = digest
+                page = page + 1
+        finally:
+            fetcher.close()
+
+        # Pages that are no longer there mean removed datasets
+        return unchanged_pages == len(stored_pages)
+
+    def _previous_job_complete(self, harvest_job):
+        '''
+        Checks if all the objects of the previous job of the source (if any)
+        were imported successfully
+        '''
+        previous_job = model.Session.query(HarvestJob.id) \
+                                    .filter(HarvestJob.source_id==harvest_job.source.id) \
+                                    .filter(HarvestJob.id!=harvest_job.id) \
+                                    .order_by(HarvestJob.created.desc()) \
+                                    .first()
+        if previous_job is None:
+            return False
+
+        incomplete = model.Session.query(HarvestObject.id) \
+                                  .filter(HarvestObject.harvest_job_id==previous_job.id) \
+                                  .filter(or_(HarvestObject.state==None,
+                                              HarvestObject.state!='COMPLETE')) \
+                                  .first()
+        return incomplete is None
+
+    def _save_pages_state(self, harvest_job, pages_state):
+        '''
+        Replaces the stored state of the pages of the job source
+        '''
+        model.Session.query(DCATHarvestPage).\
+            filter(DCATHarvestPage.harvest_source_id==harvest_job.source.id).\
+            delete()
+        for page_state in pages_state:
+            model.Session.add(page_state)
+        model.Session.commit()
+
     def get_original_url(self, harvest_object_id):
         obj = model.Session.query(HarvestObject).\
                                     filter(HarvestObject.id==harvest_object_id).\
@@ -145,6 +1068,22 @@ class DCATHarvester(HarvesterBase):
             return obj.source.url
         return None
 
+    def _get_package_dict(self, harvest_object):
+        '''
+        Returns the package dict and the dcat dict of the dataset of a
+        harvest object.
+
+        This one reads the dcat dict extracted on the gather stage (see
+        `_get_parse_in_gather`). Harvesters that store the original content
+        of the datasets extend it to map that content, and should use it for
+        objects with a 'dcat_dict' content format.
+        '''
+        dcat_dict = json.loads(harvest_object.content)
+
+        package_dict = converters.dcat_to_ckan(dcat_dict)
+
+        return package_dict, dcat_dict
+
     ## Start hooks
 
     def modify_package_dict(self, package_dict, dcat_dict, harvest_object):
@@ -159,109 +1098,259 @@ class DCATHarvester(HarvesterBase):
     def gather_stage(self,harvest_job):
         log.debug('In DCATHarvester gather_stage')
 
+        if self._get_defer_indexing():
+            # Index any datasets left over from previous jobs
+            self._index_deferred(harvest_job.id)
 
         ids = []
 
-        # Get the previous guids for this source
-        query = model.Session.query(HarvestObject.guid, HarvestObject.package_id).\
+        # Get the previous guids for this source, and the digest of their
+        # contents (if they have one)
+        query = model.Session.query(HarvestObject.guid, HarvestObject.package_id,
+                                    HarvestObjectExtra.value).\
+                                    outerjoin(HarvestObjectExtra, and_(
+                                        HarvestObjectExtra.harvest_object_id==HarvestObject.id,
+                                        HarvestObjectExtra.key=='content_hash')).\
                                     filter(HarvestObject.current==True).\
                                     filter(HarvestObject.harvest_source_id==harvest_job.source.id)
         guid_to_package_id = {}
+        guid_to_content_hash = {}
 
-        for guid, package_id in query:
+        for guid, package_id, content_hash in query:
             guid_to_package_id[guid] = package_id
+            guid_to_content_hash[guid] = content_hash
+
+        guids_in_db = set(guid_to_package_id.keys())
+        guids_in_source = set()
 
-        guids_in_db = guid_to_package_id.keys()
-        guids_in_source = []
+        # Objects are saved in batches, with a single flush per batch
+        batch_size = self._get_gather_batch_size()
+        objects = []
 
 
         # Get file contents
         url = harvest_job.source.url
 
-        previous_content = ''
-        page = 1
-        while True:
+        conditional_requests = self._get_conditional_requests()
+        if conditional_requests:
+            model_setup()
+            if not self.force_import:
+                unchanged = self._source_unchanged(url, harvest_job)
+                if unchanged is None:
+                    return None
+                elif unchanged:
+                    log.info('Source {0} has not changed since the last job'.format(url))
+                    return []
+        pages_state = []
 
-            try:
-                content = self._get_content(url, harvest_job, page)
-            except requests.exceptions.HTTPError, error:
-                if error.response.status_code == 404:
-                    if page > 1:
-                        # Server returned a 404 after the first page, no more
-                        # records
-                        log.debug('404 after first page, no more pages')
-                        break
+        parse_in_gather = self._get_parse_in_gather()
+        keep_raw_content = self._get_keep_raw_content()
+
+        fetcher = PageFetcher(self, url, harvest_job,
+                              self._get_prefetch_pages())
+        try:
+            previous_digest = None
+            page = 1
+            while True:
+
+                try:
+                    content = fetcher.get_content(page)
+                except requests.exceptions.HTTPError, error:
+                    if error.response.status_code == 404:
+                        if page > 1:
+                            # Server returned a 404 after the first page, no more
+                            # records
+                            log.debug('404 after first page, no more pages')
+                            break
+                        else:
+                            # Proper 404
+                            msg = 'Could not get content. Server responded with 404 Not Found'
+                            self._save_gather_error(msg, harvest_job)
+                            return None
                     else:
-                        # Proper 404
-                        msg = 'Could not get content. Server responded with 404 Not Found'
-                        self._save_gather_error(msg, harvest_job)
-                        return None
-                else:
-                    # This should never happen. Raising just in case.
-                    raise
+                        # This should never happen. Raising just in case.
+                        raise
 
-            if not content:
-                return None
+                if not content:
+                    return None
 
-            if previous_content == content:
-                # Server does not support pagination or no more pages
-                log.debug('Same content, no more pages')
-                break
+                if previous_digest == content.digest:
+                    # Server does not support pagination or no more pages
+                    content.close()
+                    log.debug('Same content, no more pages')
+                    if conditional_requests:
+                        # Store it too so the next job can check it with a
+                        # conditional request
+                        pages_state.append(DCATHarvestPage(
+                            harvest_source_id=harvest_job.source.id,
+                            url=self._get_page_url(url, page),
+                            etag=content.etag,
+                            last_modified=content.last_modified,
+                            digest=content.digest))
+                    break
 
-            try:
-                batch_guids = []
-                for guid, as_string in self._get_guids_and_datasets(content):
-
-                    log.debug('Got identifier: {0}'.format(guid))
-                    batch_guids.append(guid)
-
-                    if guid in guids_in_db:
-                        # Dataset needs to be udpated
-                        obj = HarvestObject(guid=guid, job=harvest_job,
-                                        package_id=guid_to_package_id[guid],
-                                        content=as_string,
-                                        extras=[HarvestObjectExtra(key='status', value='change')])
+                try:
+                    if parse_in_gather:
+                        datasets = self._get_guids_and_dcat_dicts(content)
                     else:
-                        # Dataset needs to be created
-                        obj = HarvestObject(guid=guid, job=harvest_job,
-                                        content=as_string,
-                                        extras=[HarvestObjectExtra(key='status', value='new')])
-
-                    obj.save()
-                    ids.append(obj.id)
+                        datasets = ((guid, as_string, None) for guid, as_string
+                                    in self._get_guids_and_datasets(content))
+
+                    batch_guids = []
+                    for guid, as_string, dcat_dict in datasets:
+
+                        log.debug('Got identifier: {0}'.format(guid))
+                        batch_guids.append(guid)
+
+                        format_extras = []
+                        if dcat_dict is not None:
+                            # Store the already extracted dcat dict, so the
+                            # import stage does not need to parse the dataset
+                            # again
+                            if keep_raw_content:
+                                format_extras.append(HarvestObjectExtra(key='raw_content', value=as_string))
+                            format_extras.append(HarvestObjectExtra(key='content_format', value='dcat_dict'))
+                            as_string = self._dump_dcat_dict(dcat_dict)
+
+                        content_hash = self._get_content_hash(as_string)
+
+                        if guid in guids_in_db:
+                            if (not self.force_import and
+                                    guid_to_content_hash[guid] == content_hash):
+                                # Same contents as the current object, the
+                                # dataset does not need to be updated
+                                status = 'unchanged'
+                            else:
+                                # Dataset needs to be udpated
+                                status = 'change'
+                            obj = HarvestObject(guid=guid, job=harvest_job,
+                                            package_id=guid_to_package_id[guid],
+                                            content=as_string,
+                                            extras=[HarvestObjectExtra(key='status', value=status),
+                                                    HarvestObjectExtra(key='content_hash', value=content_hash)] + format_extras)
+                        else:
+                            # Dataset needs to be created
+                            obj = HarvestObject(guid=guid, job=harvest_job,
+                                            content=as_string,
+                                            extras=[HarvestObjectExtra(key='status', value='new'),
+                                                    HarvestObjectExtra(key='content_hash', value=content_hash)] + format_extras)
+
+                        objects.append(obj)
+                        if len(objects) >= batch_size:
+                            self._save_objects(objects, ids)
+
+                    if len(batch_guids) > 0:
+                        guids_in_source.update(batch_guids)
+                        if conditional_requests:
+                            pages_state.append(DCATHarvestPage(
+                                harvest_source_id=harvest_job.source.id,
+                                url=self._get_page_url(url, page),
+                                etag=content.etag,
+                                last_modified=content.last_modified,
+                                digest=content.digest))
+                    else:
+                        log.debug('Empty document, no more records')
+                        # Empty document, no more ids
+                        break
 
-                if len(batch_guids) > 0:
-                    guids_in_source.extend(batch_guids)
-                else:
-                    log.debug('Empty document, no more records')
-                    # Empty document, no more ids
-                    break
+                except ValueError, e:
+                    msg = 'Error parsing file: {0}'.format(str(e))
+                    self._save_gather_error(msg, harvest_job)
+                    return None
+                finally:
+                    content.close()
 
-            except ValueError, e:
-                msg = 'Error parsing file: {0}'.format(str(e))
-                self._save_gather_error(msg, harvest_job)
-                return None
 
 
+                page = page + 1
+                previous_digest = content.digest
+        finally:
+            fetcher.close()
 
-            page = page + 1
-            previous_content = content
+        self._save_objects(objects, ids)
 
         # Check datasets that need to be deleted
-        guids_to_delete = set(guids_in_db) - set(guids_in_source)
-        for guid in guids_to_delete:
-            obj = HarvestObject(guid=guid, job=harvest_job,
-                                package_id=guid_to_package_id[guid],
-                                extras=[HarvestObjectExtra(key='status', value='delete')])
-            ids.append(obj.id)
+        guids_to_delete = list(guids_in_db - guids_in_source)
+        for i in xrange(0, len(guids_to_delete), batch_size):
+            batch_guids = guids_to_delete[i:i + batch_size]
+            for guid in batch_guids:
+                obj = HarvestObject(guid=guid, job=harvest_job,
+                                    package_id=guid_to_package_id[guid],
+                                    extras=[HarvestObjectExtra(key='status', value='delete')])
+                objects.append(obj)
             model.Session.query(HarvestObject).\
-                  filter_by(guid=guid).\
+                  filter(HarvestObject.guid.in_(batch_guids)).\
                   update({'current': False}, False)
-            obj.save()
+            self._save_objects(objects, ids)
 
+        model.Session.commit()
+
+        if conditional_requests:
+            self._save_pages_state(harvest_job, pages_state)
 
         return ids
 
+    def import_job(self, harvest_job_id, workers=None):
+        '''
+        Imports all the harvest objects of a job that are waiting to be
+        imported, using a pool of `workers` processes (by default the
+        `ckanext.dcat.harvest.import_workers` config option).
+
+        Objects are sent to the workers in batches of `import_batch_size`,
+        and each worker imports them with `import_batch` on its own database
+        session. Names for new datasets are reserved on a shared table while
+        the job runs, so two workers can never use the same name.
+
+        The worker processes are forked when this is called, so the caller
+        must not have any open database connections (`paster dcat import`
+        disposes of its engine before calling it).
+
+        Returns the number of objects imported successfully and the number
+        of errors.
+        '''
+        workers = workers or self._get_import_workers() or 1
+        batch_size = self._get_import_batch_size()
+
+        # Fork the workers before opening any connections
+        pool = Pool(workers)
+        imported, errors = 0, 0
+        try:
+            model_setup()
+
+            object_ids = [row.id for row in
+                          model.Session.query(HarvestObject.id)
+                                       .filter(HarvestObject.harvest_job_id==harvest_job_id)
+                                       .filter(HarvestObject.state=='WAITING')]
+            # Get the site user name once, so the workers do not need to
+            user_name = self._get_user_name()
+
+            batches = [(self.__class__, user_name, self.force_import,
+                        object_ids[i:i + batch_size])
+                       for i in xrange(0, len(object_ids), batch_size)]
+            log.info('Importing {0} objects of job {1} with {2} workers'.format(
+                     len(object_ids), harvest_job_id, workers))
+
+            for batch_imported, batch_errors in pool.imap_unordered(_import_worker, batches):
+                imported += batch_imported
+                errors += batch_errors
+                log.debug('Imported {0} objects, {1} errors'.format(imported, errors))
+        finally:
+            pool.close()
+            pool.join()
+
+        model.Session.query(DCATNameReservation) \
+                     .filter(DCATNameReservation.harvest_job_id==harvest_job_id) \
+                     .delete(synchronize_session=False)
+        model.Session.commit()
+
+        if self._get_defer_indexing():
+            self._index_deferred(harvest_job_id)
+
+        log.info('Finished importing objects of job {0}: {1} imported, {2} '
+                 'errors'.format(harvest_job_id, imported, errors))
+
+        return imported, errors
+
     def fetch_stage(self,harvest_object):
         return True
 
@@ -271,40 +1360,173 @@ class DCATHarvester(HarvesterBase):
             log.error('No harvest object received')
             return False
 
+        if not self._get_defer_indexing():
+            return self._import_object(harvest_object)
+
+        model_setup()
+        result = False
+        try:
+            with _automatic_indexing_disabled():
+                result = self._import_object(harvest_object, defer_indexing=True)
+        except Exception:
+            model.Session.rollback()
+            raise
+        finally:
+            # The harvest queue only sets the state of the object once this
+            # returns, set it now so the job can be seen as finished
+            harvest_object.state = 'COMPLETE' if result else 'ERROR'
+            model.Session.add(harvest_object)
+            model.Session.commit()
+            self._index_deferred(harvest_object.harvest_job_id)
+
+        return result
+
+    def import_batch(self, harvest_objects):
+        '''
+        Imports a list of harvest objects of the same job in a single
+        transaction, instead of committing after each one of them as
+        `import_stage` does.
+
+        Each object is imported inside its own savepoint, so an error on one
+        dataset only rolls back the changes for that object. Errors are
+        stored and the state of the objects updated once all of them have
+        been processed.
+
+        Returns a list with the result of the import of each object.
+        '''
+        if not self._get_defer_indexing():
+            return self._import_batch(harvest_objects)
+
+        model_setup()
+        with _automatic_indexing_disabled():
+            results = self._import_batch(harvest_objects, defer_indexing=True)
+        if harvest_objects:
+            # The state of the objects has already been committed
+            self._index_deferred(harvest_objects[0].harvest_job_id)
+
+        return results
+
+    def _import_batch(self, harvest_objects, defer_indexing=False):
+        if harvest_objects and self._get_allocate_names():
+            # Load the names in use for all the titles known in advance
+            allocator = self._get_name_allocator(harvest_objects[0].harvest_job_id)
+            allocator.load([self._get_title_hint(harvest_object.content,
+                                                 self._get_content_format(harvest_object))
+                            for harvest_object in harvest_objects])
+
+        results = []
+        errors = []
+        for harvest_object in harvest_objects:
+            harvest_object.import_started = datetime.datetime.utcnow()
+
+            savepoint = model.Session.begin_nested()
+            try:
+                result = self._import_object(harvest_object, defer_commit=True,
+                                             errors=errors,
+                                             defer_indexing=defer_indexing)
+            except Exception, e:
+                log.exception(e)
+                # Some actions commit regardless of defer_commit, which
+                # releases the savepoint
+                if savepoint.is_active:
+                    model.Session.rollback()
+                errors.append(('Error importing dataset: {0}'.format(e),
+                               harvest_object))
+                result = False
+            else:
+                if savepoint.is_active:
+                    model.Session.commit()
+
+            results.append(result)
+
+        now = datetime.datetime.utcnow()
+        for harvest_object, result in zip(harvest_objects, results):
+            harvest_object.state = 'COMPLETE' if result else 'ERROR'
+            harvest_object.import_finished = now
+            model.Session.add(harvest_object)
+        for message, harvest_object in errors:
+            log.error(message)
+            model.Session.add(HarvestObjectError(message=message,
+                                                 object=harvest_object,
+                                                 stage='Import'))
+        model.Session.commit()
+
+        return results
+
+    def _import_object(self, harvest_object, defer_commit=False, errors=None,
+                       defer_indexing=False):
+        '''
+        Creates, updates or deletes the dataset of a harvest object.
+
+        If `defer_commit` is True the changes are not committed, and if an
+        `errors` list is provided, errors are appended to it as (message,
+        harvest_object) tuples instead of being saved. If `defer_indexing`
+        is True, created, updated or deleted datasets are added to the list
+        of datasets pending to be indexed.
+        '''
+        preloaded = self._get_preloaded_object(harvest_object)
+
         if self.force_import:
             status = 'change'
+        elif preloaded is not None:
+            status = preloaded.status
         else:
             status = self._get_object_extra(harvest_object, 'status')
 
+        if status == 'unchanged':
+            # Same contents as the current object, keep it as the current
+            # one and leave the dataset untouched
+            log.debug('Dataset with guid {0} has not changed'.format(harvest_object.guid))
+
+            return True
+
         if status == 'delete':
             # Delete package
-            context = {'model': model, 'session': model.Session, 'user': self._get_user_name()}
+            context = {'model': model, 'session': model.Session, 'user': self._get_user_name(),
+                       'defer_commit': defer_commit}
 
             p.toolkit.get_action('package_delete')(context, {'id': harvest_object.package_id})
             log.info('Deleted package {0} with guid {1}'.format(harvest_object.package_id, harvest_object.guid))
 
+            if defer_indexing:
+                # The dataset will be removed from the index later on
+                model.Session.merge(DCATPendingIndex(package_id=harvest_object.package_id,
+                                                     harvest_job_id=harvest_object.harvest_job_id))
+                self._pending_index_count += 1
+
             return True
 
 
         if harvest_object.content is None:
-            self._save_object_error('Empty content for object %s' % harvest_object.id,harvest_object,'Import')
+            message = 'Empty content for object %s' % harvest_object.id
+            if errors is None:
+                self._save_object_error(message,harvest_object,'Import')
+            else:
+                errors.append((message, harvest_object))
             return False
 
-        # Get the last harvested object (if any)
-        previous_object = model.Session.query(HarvestObject) \
-                          .filter(HarvestObject.guid==harvest_object.guid) \
-                          .filter(HarvestObject.current==True) \
-                          .first()
-
-        # Flag previous object as not current anymore
-        if previous_object and not self.force_import:
-            previous_object.current = False
-            previous_object.add()
+        if preloaded is not None:
+            # Flag previous object (if any) as not current anymore
+            if preloaded.current_id and not self.force_import:
+                model.Session.query(HarvestObject) \
+                             .filter(HarvestObject.id==preloaded.current_id) \
+                             .update({'current': False}, False)
+        else:
+            # Get the last harvested object (if any)
+            previous_object = model.Session.query(HarvestObject) \
+                              .filter(HarvestObject.guid==harvest_object.guid) \
+                              .filter(HarvestObject.current==True) \
+                              .first()
 
+            # Flag previous object as not current anymore
+            if previous_object and not self.force_import:
+                previous_object.current = False
+                previous_object.add()
 
         package_dict, dcat_dict = self._get_package_dict(harvest_object)
         if not package_dict.get('name'):
-            package_dict['name'] = self._get_package_name(harvest_object, package_dict['title'])
+            package_dict['name'] = self._get_package_name(harvest_object, package_dict['title'],
+                                                          preloaded)
 
         # Allow custom harvesters to modify the package dict before creating
         # or updating the package
@@ -320,6 +1542,7 @@ class DCATHarvester(HarvesterBase):
             'user': self._get_user_name(),
             'return_id_only': True,
             'ignore_auth': True,
+            'defer_commit': defer_commit,
         }
 
         if status == 'new':
@@ -350,7 +1573,14 @@ class DCATHarvester(HarvesterBase):
             package_id = p.toolkit.get_action('package_update')(context, package_dict)
             log.info('Updated dataset with id %s', package_id)
 
-        model.Session.commit()
+        if defer_indexing and status in ('new', 'change'):
+            # The dataset will be indexed later on along with other ones
+            model.Session.merge(DCATPendingIndex(package_id=package_id,
+                                                 harvest_job_id=harvest_object.harvest_job_id))
+            self._pending_index_count += 1
+
+        if not defer_commit:
+            model.Session.commit()
 
         return True
 
@@ -371,9 +1601,40 @@ class DCATXMLHarvester(DCATHarvester):
 
     def _get_guids_and_datasets(self, content):
 
-        doc = etree.fromstring(content)
+        for guid, as_string, dataset_element in self._get_guids_and_elements(content):
+            yield guid, as_string
+
+    def _get_guids_and_dcat_dicts(self, content):
+
+        engine = config.get('ckanext.dcat.harvest.xml_engine', 'xpath')
+
+        # Parse the document the same way formats.xml does, so the values
+        # are the same as the ones extracted on the import stage
+        for guid, as_string, dataset_element in self._get_guids_and_elements(
+                content, remove_blank_text=True):
+            try:
+                dataset = formats.xml.DCATDataset(xml_tree=dataset_element,
+                                                  engine=engine)
+                dcat_dict = dataset.read_values()
+            except Exception, e:
+                log.warning('Could not extract the dataset with guid {0}, '
+                            'it will be extracted on the import stage: {1}'
+                            .format(guid, e))
+                dcat_dict = None
+
+            yield guid, as_string, dcat_dict
+
+    def _get_guids_and_elements(self, content, remove_blank_text=False):
+
+        if p.toolkit.asbool(config.get('ckanext.dcat.harvest.xml_streaming', False)):
+            dataset_elements = self._iter_dataset_elements(content,
+                                                           remove_blank_text)
+        else:
+            parser = etree.XMLParser(remove_blank_text=remove_blank_text)
+            doc = etree.parse(_open_content(content), parser).getroot()
+            dataset_elements = doc.xpath('//dcat:Dataset',namespaces={'dcat': self.DCAT_NS})
 
-        for dataset_element in doc.xpath('//dcat:Dataset',namespaces={'dcat': self.DCAT_NS}) :
+        for dataset_element in dataset_elements:
 
             as_string = etree.tostring(dataset_element)
 
@@ -387,14 +1648,39 @@ class DCATXMLHarvester(DCATHarvester):
                     # This is bad, any ideas welcomed
                     guid = sha1(as_string).hexdigest()
 
-            yield guid, as_string
+            yield guid, as_string, dataset_element
+
+    def _iter_dataset_elements(self, content, remove_blank_text=False):
+        '''
+        Yields the dcat:Dataset elements of the document as soon as their end
+        tag is parsed. Once the consumer is done with an element, it is
+        cleared and all the elements already processed are removed from the
+        tree, so only one dataset is kept in memory at a time.
+        '''
+        tag = '{{{ns}}}Dataset'.format(ns=self.DCAT_NS)
+        for event, element in etree.iterparse(_open_content(content),
+                                              events=('end',), tag=tag,
+                                              remove_blank_text=remove_blank_text):
+            yield element
+
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+            for ancestor in element.iterancestors():
+                while ancestor.getprevious() is not None:
+                    del ancestor.getparent()[0]
 
 
     def _get_package_dict(self, harvest_object):
 
+        if self._get_content_format(harvest_object) == 'dcat_dict':
+            # The dataset was already mapped on the gather stage
+            return super(DCATXMLHarvester, self)._get_package_dict(harvest_object)
+
         content = harvest_object.content
 
-        dataset = formats.xml.DCATDataset(content)
+        engine = config.get('ckanext.dcat.harvest.xml_engine', 'xpath')
+        dataset = formats.xml.DCATDataset(content, engine=engine)
         dcat_dict = dataset.read_values()
 
         package_dict = converters.dcat_to_ckan(dcat_dict)
@@ -405,6 +1691,8 @@ class DCATXMLHarvester(DCATHarvester):
 
 class DCATJSONHarvester(DCATHarvester):
 
+    _titles_in_original_content = True
+
     def info(self):
         return {
             'name': 'dcat_json',
@@ -414,27 +1702,55 @@ class DCATJSONHarvester(DCATHarvester):
 
     def _get_guids_and_datasets(self, content):
 
-        doc = json.loads(content)
+        for guid, as_string, dataset in self._get_guids_and_dcat_dicts(content):
+            yield guid, as_string
 
-        if isinstance(doc, list):
-            # Assume a list of datasets
-            datasets = doc
-        elif isinstance(doc, dict):
-            datasets = doc.get('dataset', [])
+    def _get_guids_and_dcat_dicts(self, content):
+
+        if p.toolkit.asbool(config.get('ckanext.dcat.harvest.json_streaming', False)):
+            # Parse the datasets one at a time, keeping their original text
+            datasets = formats.json_stream.iter_datasets(
+                _open_content(content), self._get_chunk_size())
         else:
-            raise ValueError('Wrong JSON object')
+            datasets = ((dataset, None) for dataset in
+                        self._get_datasets(_read_content(content)))
 
-        for dataset in datasets:
+        for dataset, as_string in datasets:
 
-            as_string = json.dumps(dataset)
+            if as_string is None:
+                as_string = json.dumps(dataset)
+            else:
+                as_string = as_string.decode('utf8')
 
             # Get identifier
             guid = dataset.get('identifier')
             if not guid:
                 # This is bad, any ideas welcomed
-                guid = sha1(as_string).hexdigest()
+                guid = sha1(json.dumps(dataset)).hexdigest()
 
-            yield guid, as_string
+            yield guid, as_string, dataset
+
+    def _get_title_hint(self, content, content_format):
+        if not content:
+            return None
+        try:
+            return json.loads(content).get('title')
+        except ValueError:
+            return None
+
+    def _get_datasets(self, content):
+
+        doc = json.loads(content)
+
+        if isinstance(doc, list):
+            # Assume a list of datasets
+            datasets = doc
+        elif isinstance(doc, dict):
+            datasets = doc.get('dataset', [])
+        else:
+            raise ValueError('Wrong JSON object')
+
+        return datasets
 
     def _get_package_dict(self, harvest_object):
 
@@ -0,0 +1,123 @@
+import logging
+import datetime
+
+from sqlalchemy import Table, Column, Index, types
+
+from ckan import model
+from ckan.model.meta import metadata, mapper
+from ckan.model.types import make_uuid
+from ckan.model.domain_object import DomainObject
+
+log = logging.getLogger(__name__)
+
+__all__ = [
+    'DCATHarvestPage', 'dcat_harvest_page_table',
+    'DCATPendingIndex', 'dcat_pending_index_table',
+    'DCATNameReservation', 'dcat_name_reservation_table',
+    'DCATPackageJSON', 'dcat_package_json_table',
+]
+
+dcat_harvest_page_table = None
+dcat_pending_index_table = None
+dcat_name_reservation_table = None
+dcat_package_json_table = None
+
+# Whether the tables are known to exist on the database
+_tables_created = False
+
+
+def setup():
+
+    global _tables_created
+
+    if dcat_harvest_page_table is None:
+        define_dcat_tables()
+        log.debug('DCAT tables defined in memory')
+
+    if _tables_created:
+        return
+
+    if model.package_table.exists():
+        for table in (dcat_harvest_page_table, dcat_pending_index_table,
+                      dcat_name_reservation_table, dcat_package_json_table):
+            if not table.exists():
+                table.create()
+                log.debug('DCAT table {0} created'.format(table.name))
+        _tables_created = True
+    else:
+        log.debug('DCAT table creation deferred')
+
+
+class DCATHarvestPage(DomainObject):
+    '''The HTTP validators and content digest of a page of a harvest source,
+    as they were on the last harvest job. They are used to find out if the
+    source has changed since then.
+    '''
+    pass
+
+
+class DCATPendingIndex(DomainObject):
+    '''A dataset created or updated by a harvest job with deferred indexing,
+    that still needs to be added to the search index.
+    '''
+    pass
+
+
+class DCATNameReservation(DomainObject):
+    '''A dataset name claimed by one of the import workers of a harvest job,
+    so no other worker can use it for a different dataset.
+    '''
+    pass
+
+
+class DCATPackageJSON(DomainObject):
+    '''The serialized DCAT representation of a dataset, updated whenever the
+    dataset changes so it does not need to be generated on each request.
+    '''
+    pass
+
+
+def define_dcat_tables():
+
+    global dcat_harvest_page_table
+    global dcat_pending_index_table
+    global dcat_name_reservation_table
+    global dcat_package_json_table
+
+    dcat_harvest_page_table = Table('dcat_harvest_page', metadata,
+        Column('id', types.UnicodeText, primary_key=True, default=make_uuid),
+        Column('harvest_source_id', types.UnicodeText, nullable=False),
+        Column('url', types.UnicodeText, nullable=False),
+        Column('etag', types.UnicodeText),
+        Column('last_modified', types.UnicodeText),
+        Column('digest', types.UnicodeText),
+        Column('created', types.DateTime, default=datetime.datetime.utcnow),
+        Index('idx_dcat_harvest_page_source_id', 'harvest_source_id'),
+    )
+
+    mapper(DCATHarvestPage, dcat_harvest_page_table)
+
+    dcat_pending_index_table = Table('dcat_pending_index', metadata,
+        Column('package_id', types.UnicodeText, primary_key=True),
+        Column('harvest_job_id', types.UnicodeText),
+        Column('created', types.DateTime, default=datetime.datetime.utcnow),
+    )
+
+    mapper(DCATPendingIndex, dcat_pending_index_table)
+
+    dcat_name_reservation_table = Table('dcat_name_reservation', metadata,
+        Column('name', types.UnicodeText, primary_key=True),
+        Column('harvest_job_id', types.UnicodeText),
+        Column('created', types.DateTime, default=datetime.datetime.utcnow),
+    )
+
+    mapper(DCATNameReservation, dcat_name_reservation_table)
+
+    dcat_package_json_table = Table('dcat_package_json', metadata,
+        Column('package_id', types.UnicodeText, primary_key=True),
+        Column('dcat_json', types.UnicodeText),
+        Column('modified', types.DateTime, default=datetime.datetime.utcnow,
+               onupdate=datetime.datetime.utcnow),
+    )
+
+    mapper(DCATPackageJSON, dcat_package_json_table)
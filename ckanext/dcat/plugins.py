@@ -1,9 +1,15 @@
+import re
 import json
+import logging
+import base64
+from hashlib import sha1
 
 from pylons import config
 from dateutil.parser import parse as dateutil_parse
 
 from ckan import plugins as p
+from ckan import model
+from ckan.lib.search import query_for
 
 if p.toolkit.check_ckan_version(min_version='2.1'):
     BaseController = p.toolkit.BaseController
@@ -11,19 +17,68 @@ else:
     from ckan.lib.base import BaseController
 
 import ckanext.dcat.converters as converters
+from ckanext.dcat.cache import MemoryCache, RedisCache
+from ckanext.dcat import compress
+from ckanext.dcat.model import setup as model_setup, DCATPackageJSON
+
+log = logging.getLogger(__name__)
+
+_response_cache = None
+
+
+def _get_precomputed_json():
+    '''
+    Whether the DCAT representation of datasets is stored when they change
+    and used instead of generating it on each request, set with the
+    `ckanext.dcat.precomputed_json` config option
+    '''
+    return p.toolkit.asbool(config.get('ckanext.dcat.precomputed_json', False))
+
+
+def get_response_cache():
+    '''
+    Returns the cache for the DCAT JSON endpoint responses, set with the
+    `ckanext.dcat.cache_backend` config option ('memory' or 'redis'), or
+    None if the cache is disabled
+    '''
+    global _response_cache
+
+    backend = config.get('ckanext.dcat.cache_backend')
+    if not backend:
+        return None
+
+    if _response_cache is None:
+        ttl = int(config.get('ckanext.dcat.cache_ttl', 300))
+        if backend == 'memory':
+            size = int(config.get('ckanext.dcat.cache_size', 1000))
+            _response_cache = MemoryCache(size, ttl)
+        elif backend == 'redis':
+            url = config.get('ckanext.dcat.cache_redis_url',
+                             'redis://localhost:6379/0')
+            _response_cache = RedisCache(url, ttl)
+        else:
+            raise ValueError('Unknown cache backend: {0}'.format(backend))
+
+    return _response_cache
 
 
 class DCATJSONInterface(p.SingletonPlugin):
 
     p.implements(p.IRoutes, inherit=True)
     p.implements(p.IActions)
+    p.implements(p.IPackageController, inherit=True)
 
     ## IRoutes
     def after_map(self, map):
 
         controller = 'ckanext.dcat.plugins:DCATController'
         route = config.get('ckanext.dcat.json_endpoint', '/dcat.json')
-        map.connect(route, controller=controller, action='dcat_json')
+        if config.get('ckanext.dcat.static_pages_url'):
+            # Pages are served from the files written by generate_static
+            action = 'dcat_json_static'
+        else:
+            action = 'dcat_json'
+        map.connect(route, controller=controller, action=action)
 
         return map
 
@@ -33,41 +88,461 @@ class DCATJSONInterface(p.SingletonPlugin):
             'dcat_datasets_list': dcat_datasets_list,
         }
 
+    ## IPackageController
+    def after_create(self, context, pkg_dict):
+        if _get_precomputed_json():
+            store_dcat_json(pkg_dict)
+
+    def after_update(self, context, pkg_dict):
+        if _get_precomputed_json():
+            store_dcat_json(pkg_dict)
+
+    def after_delete(self, context, pkg_dict):
+        if _get_precomputed_json():
+            # The id can also be the dataset name
+            package = model.Package.get(pkg_dict['id'])
+            if package:
+                delete_dcat_json(package.id)
+
 
 class DCATController(BaseController):
 
+    def dcat_json_static(self):
+        '''
+        Redirects requests for a page of the catalog to its static file, at
+        the URL set with the `ckanext.dcat.static_pages_url` config option
+        (with a `{page}` placeholder). Other requests (or invalid pages) are
+        handled as usual.
+        '''
+        params = p.toolkit.request.params
+        if not params.get('modified_since') and not params.get('cursor'):
+            try:
+                page = int(params.get('page') or 1)
+            except ValueError:
+                page = 0
+            if page >= 1:
+                url = config.get('ckanext.dcat.static_pages_url')
+                p.toolkit.response.status_int = 302
+                p.toolkit.response.headers['Location'] = url.format(page=page)
+                return ''
+
+        return self.dcat_json()
+
     def dcat_json(self):
 
         data_dict = {
             'page': p.toolkit.request.params.get('page'),
             'modified_since': p.toolkit.request.params.get('modified_since'),
+            'cursor': p.toolkit.request.params.get('cursor'),
         }
 
-        try:
-            datasets = p.toolkit.get_action('dcat_datasets_list')({},
-                                                                  data_dict)
-        except p.toolkit.ValidationError, e:
-            p.toolkit.abort(409, str(e))
+        content = None
+        etag = None
+        gzip_level = self._get_gzip_level()
+
+        cache = get_response_cache()
+        if cache is not None:
+            etag = _get_etag(data_dict)
+            # Compressed responses are a different representation, so they
+            # need a different ETag
+            response_etag = etag[:-1] + '-gzip"' if gzip_level else etag
+            p.toolkit.response.headers['ETag'] = response_etag
+            if _etag_matches(p.toolkit.request.headers.get('If-None-Match'),
+                             response_etag):
+                p.toolkit.response.status_int = 304
+                return ''
+            content = cache.get(etag)
+
+        stream = p.toolkit.asbool(config.get('ckanext.dcat.stream_json', False))
+
+        if content is None and (stream or _get_precomputed_json()):
+            # Serialize the datasets one at a time (using the precomputed
+            # JSON if available)
+            try:
+                ckan_datasets = _search_ckan_datasets({}, data_dict)
+            except p.toolkit.ValidationError, e:
+                p.toolkit.abort(409, str(e))
+
+            chunks = _iter_datasets_json(ckan_datasets,
+                                         bool(data_dict.get('cursor')))
+
+            if stream:
+                if cache is not None:
+                    chunks = _cache_chunks(chunks, cache, etag)
+
+                # No Content-Length, the response is sent in chunks as they
+                # are generated
+                p.toolkit.response.headers['Content-Type'] = 'application/json'
+
+                if gzip_level:
+                    p.toolkit.response.headers['Content-Encoding'] = 'gzip'
+                    chunks = compress.iter_gzip(chunks, gzip_level)
+
+                return chunks
 
-        content = json.dumps(datasets)
+            content = ''.join(chunks)
+
+            if cache is not None:
+                cache.set(etag, content)
+
+        if content is None:
+            try:
+                datasets = p.toolkit.get_action('dcat_datasets_list')({},
+                                                                      data_dict)
+            except p.toolkit.ValidationError, e:
+                p.toolkit.abort(409, str(e))
+
+            content = json.dumps(datasets)
+
+            if cache is not None:
+                cache.set(etag, content)
+
+        if gzip_level:
+            p.toolkit.response.headers['Content-Encoding'] = 'gzip'
+            content = compress.gzip_string(content, gzip_level)
 
         p.toolkit.response.headers['Content-Type'] = 'application/json'
         p.toolkit.response.headers['Content-Length'] = len(content)
 
         return content
 
+    def _get_gzip_level(self):
+        '''
+        Returns the level used to compress the response with gzip, set with
+        the `ckanext.dcat.gzip_level` config option, or 0 if the response
+        should not be compressed (because it is disabled or the client does
+        not accept it)
+        '''
+        level = int(config.get('ckanext.dcat.gzip_level', 0))
+        if not level:
+            return 0
+
+        p.toolkit.response.headers['Vary'] = 'Accept-Encoding'
+        if not compress.accepts_gzip(
+                p.toolkit.request.headers.get('Accept-Encoding')):
+            return 0
+
+        return level
+
+
+def _get_etag(data_dict):
+    '''
+    Returns the ETag for a page of the DCAT JSON endpoint. It is derived from
+    the latest metadata_modified date and the number of datasets on the
+    catalog, so it changes whenever a dataset is created, updated or deleted.
+    As it is also the cache key, cached responses do not need to be cleared
+    when datasets change.
+    '''
+    # Only the date is read from the index, not the whole dataset
+    query = query_for(model.Package).run({
+        'q': '*:*',
+        'fq': '+capacity:public +dataset_type:dataset',
+        'fl': 'metadata_modified',
+        'rows': 1,
+        'sort': 'metadata_modified desc',
+    })
+    latest = query['results'][0]['metadata_modified'] if query['results'] else ''
+
+    key = u'|'.join([
+        unicode(latest),
+        unicode(query['count']),
+        unicode(data_dict.get('page') or ''),
+        unicode(data_dict.get('modified_since') or ''),
+        unicode(data_dict.get('cursor') or ''),
+        unicode(get_datasets_per_page()),
+    ])
+
+    return '"{0}"'.format(sha1(key.encode('utf8')).hexdigest())
+
+
+def _iter_datasets_json(ckan_datasets, cursor=False):
+    '''
+    Returns an iterator with the JSON serialization of a page of the DCAT
+    JSON endpoint in chunks, one dataset at a time (see `_iter_dcat_json`).
+    '''
+    next_cursor = _get_next_cursor(ckan_datasets) if cursor else None
+
+    return _iter_page_chunks(_iter_dcat_json(ckan_datasets), cursor,
+                             next_cursor)
+
+
+def _iter_page_chunks(dcat_jsons, cursor, next_cursor):
+
+    if cursor:
+        yield '{"dataset": ['
+    else:
+        yield '['
+
+    separator = ''
+    for dcat_json in dcat_jsons:
+        yield separator + dcat_json
+        separator = ', '
+
+    if cursor:
+        yield '], "next_cursor": {0}}}'.format(json.dumps(next_cursor))
+    else:
+        yield ']'
+
+
+def _iter_dcat_json(ckan_datasets):
+    '''
+    Returns an iterator with the serialized DCAT representation of each
+    dataset, converting and encoding one at a time, or using the stored one
+    if precomputed JSON is enabled. Datasets are removed from the
+    `ckan_datasets` list as they are converted.
+
+    All database queries are done before returning, as streamed responses
+    are iterated once the request session has been removed.
+    '''
+    stored = {}
+    if _get_precomputed_json():
+        stored = get_dcat_json(ckan_datasets)
+        for i, ckan_dataset in enumerate(ckan_datasets):
+            if ckan_dataset['id'] not in stored:
+                # Only the ids were retrieved from the search index
+                log.warning('No DCAT JSON stored for dataset {0}'.format(
+                            ckan_dataset['id']))
+                ckan_datasets[i] = p.toolkit.get_action('package_show')(
+                    {'ignore_auth': True}, {'id': ckan_dataset['id']})
+
+    return _iter_converted_json(ckan_datasets, stored)
+
+
+def _iter_converted_json(ckan_datasets, stored):
+
+    ckan_datasets.reverse()
+    while ckan_datasets:
+        ckan_dataset = ckan_datasets.pop()
+
+        dcat_json = stored.pop(ckan_dataset['id'], None)
+        if dcat_json is None:
+            dcat_json = json.dumps(converters.ckan_to_dcat(ckan_dataset))
+
+        yield dcat_json
+
+
+def _cache_chunks(chunks, cache, key):
+    '''
+    Yields the chunks of a response, and stores the whole response on the
+    cache once they have all been sent
+    '''
+    content = []
+    for chunk in chunks:
+        content.append(chunk)
+        yield chunk
+    cache.set(key, ''.join(content))
+
+
+def _etag_matches(if_none_match, etag):
+    '''
+    Checks if an ETag is one of the ones on an If-None-Match header
+    '''
+    if not if_none_match:
+        return False
+    etags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in etags or etag in etags or 'W/' + etag in etags
+
 
 def dcat_datasets_list(context, data_dict):
 
     ckan_datasets = _search_ckan_datasets(context, data_dict)
+    if data_dict.get('cursor'):
+        next_cursor = _get_next_cursor(ckan_datasets)
+
+    if _get_precomputed_json():
+        datasets = [json.loads(dcat_json)
+                    for dcat_json in _iter_dcat_json(ckan_datasets)]
+    else:
+        datasets = [converters.ckan_to_dcat(ckan_dataset)
+                    for ckan_dataset in ckan_datasets]
+
+    if data_dict.get('cursor'):
+        # Return the cursor for the next page along with the datasets
+        return {
+            'dataset': datasets,
+            'next_cursor': next_cursor,
+        }
+
+    return datasets
+
+
+def dcat_json_page(data_dict, with_ids=False):
+    '''
+    Returns a list with the serialized DCAT representation of the datasets
+    on a page of the catalog, for the same parameters as dcat_datasets_list.
+
+    With `with_ids`, the list has (id, metadata_modified, serialized dataset)
+    tuples instead.
+    '''
+    ckan_datasets = _search_ckan_datasets({}, data_dict)
+    ids = [(ckan_dataset['id'], ckan_dataset.get('metadata_modified'))
+           for ckan_dataset in ckan_datasets]
+
+    dcat_jsons = list(_iter_dcat_json(ckan_datasets))
+    if with_ids:
+        return [(dataset_id, modified, dcat_json) for (dataset_id, modified),
+                dcat_json in zip(ids, dcat_jsons)]
+    return dcat_jsons
+
+
+def get_dataset_ids(batch_size=1000):
+    '''
+    Returns a set with the ids of all the datasets on the catalog, as listed
+    by dcat_datasets_list, requesting `batch_size` of them at a time (up to
+    MAX_DATASETS_PER_PAGE)
+
+    Batches are paginated by id (getting the ids after the last one of the
+    previous batch) rather than by offset, so datasets created or deleted
+    meanwhile do not make existing ones be skipped.
+    '''
+    batch_size = min(batch_size, MAX_DATASETS_PER_PAGE)
+
+    dataset_ids = set()
+    last_id = None
+    while True:
+        fq = '+capacity:public +dataset_type:dataset'
+        if last_id is not None:
+            fq += ' +id:{{{0} TO *}}'.format(last_id)
+        # With just the id field, the search query returns a list of ids
+        dataset_ids_batch = query_for(model.Package).run({
+            'q': '*:*',
+            'fq': fq,
+            'fl': 'id',
+            'rows': batch_size,
+            'sort': 'id asc',
+        })['results']
+        if not dataset_ids_batch:
+            return dataset_ids
+        dataset_ids.update(dataset_ids_batch)
+        last_id = dataset_ids_batch[-1]
+
+
+def store_dcat_json(package_dict):
+    '''
+    Stores the serialized DCAT representation of a dataset, replacing the
+    previous one. It is not committed.
+    '''
+    model_setup()
+
+    dcat_json = json.dumps(converters.ckan_to_dcat(package_dict))
+    model.Session.merge(DCATPackageJSON(package_id=package_dict['id'],
+                                        dcat_json=dcat_json))
+
+
+def delete_dcat_json(package_id):
+    '''
+    Deletes the stored DCAT representation of a dataset. It is not
+    committed.
+    '''
+    model_setup()
+
+    model.Session.query(DCATPackageJSON) \
+                 .filter(DCATPackageJSON.package_id==package_id) \
+                 .delete(synchronize_session=False)
+
+
+def get_dcat_json(ckan_datasets):
+    '''
+    Returns a dict with the stored DCAT representation of the given
+    datasets, keyed by their id
+    '''
+    if not ckan_datasets:
+        return {}
+
+    model_setup()
+
+    query = model.Session.query(DCATPackageJSON.package_id,
+                                DCATPackageJSON.dcat_json) \
+                         .filter(DCATPackageJSON.package_id.in_(
+                             [ckan_dataset['id'] for ckan_dataset in ckan_datasets]))
+
+    return dict((row.package_id, row.dcat_json) for row in query)
+
+
+def backfill_dcat_json(batch_size=100):
+    '''
+    Stores the DCAT representation of all active datasets, committing every
+    `batch_size` datasets. Returns the number of datasets processed.
+    '''
+    model_setup()
+
+    package_ids = [row.id for row in
+                   model.Session.query(model.Package.id)
+                                .filter(model.Package.state=='active')]
+    context = {'model': model, 'session': model.Session, 'ignore_auth': True}
+
+    for i, package_id in enumerate(package_ids, 1):
+        package_dict = p.toolkit.get_action('package_show')(
+            context.copy(), {'id': package_id})
+        store_dcat_json(package_dict)
+
+        if i % batch_size == 0:
+            model.Session.commit()
+            log.info('Stored DCAT JSON for {0} of {1} datasets'.format(
+                     i, len(package_ids)))
+
+    model.Session.commit()
+
+    return len(package_ids)
+
+
+def _get_next_cursor(ckan_datasets):
+    '''
+    Returns the cursor for the page after the given datasets, or None if
+    this is the last one
+    '''
+    if len(ckan_datasets) < get_datasets_per_page() or not ckan_datasets:
+        return None
+    return _encode_cursor(ckan_datasets[-1])
+
+
+# CKAN returns at most this number of rows on each search
+MAX_DATASETS_PER_PAGE = 1000
+
+
+def get_datasets_per_page():
+    '''
+    Returns the number of datasets on each page, set with the
+    `ckanext.dcat.datasets_per_page` config option, up to
+    MAX_DATASETS_PER_PAGE
+    '''
+    return min(int(config.get('ckanext.dcat.datasets_per_page', 100)),
+               MAX_DATASETS_PER_PAGE)
+
 
-    return [converters.ckan_to_dcat(ckan_dataset)
-            for ckan_dataset in ckan_datasets]
+_CURSOR_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}Z$')
+_CURSOR_ID = re.compile(r'^[\w-]+$')
+
+
+def _encode_cursor(ckan_dataset):
+    '''
+    Returns an opaque cursor pointing after the given dataset, with its
+    metadata_modified date (with the millisecond precision of the search
+    index) and id
+    '''
+    modified = dateutil_parse(ckan_dataset['metadata_modified'])
+    modified = '{0}.{1:03d}Z'.format(modified.strftime('%Y-%m-%dT%H:%M:%S'),
+                                     modified.microsecond // 1000)
+    return base64.urlsafe_b64encode(json.dumps([modified,
+                                                ckan_dataset['id']]))
+
+
+def _decode_cursor(cursor):
+    '''
+    Returns the metadata_modified date and id encoded on a cursor
+    '''
+    try:
+        modified, dataset_id = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        if _CURSOR_DATE.match(modified) and _CURSOR_ID.match(dataset_id):
+            return modified, dataset_id
+    except (TypeError, ValueError):
+        pass
+    raise p.toolkit.ValidationError('Wrong cursor')
 
 
 def _search_ckan_datasets(context, data_dict):
 
-    n = int(config.get('ckanext.dcat.datasets_per_page', 100))
+    n = get_datasets_per_page()
     page = data_dict.get('page', 1) or 1
 
     wrong_page_exception = p.toolkit.ValidationError(
@@ -96,10 +571,113 @@ def _search_ckan_datasets(context, data_dict):
 
     if modified_since:
         search_data_dict.update({
-            'fq': 'metadata_modified:[{0} TO NOW]'.format(modified_since),
+            'fq': '+dataset_type:dataset '
+                  '+metadata_modified:[{0} TO NOW]'.format(modified_since),
             'sort': 'metadata_modified desc',
         })
 
+    cursor = data_dict.get('cursor')
+    if cursor:
+        # Keyset pagination, sort by a unique key and get the datasets after
+        # the last one of the previous page. '*' means the first page.
+        fq = ['+dataset_type:dataset']
+        if modified_since:
+            fq.append('+metadata_modified:[{0} TO NOW]'.format(modified_since))
+        if cursor != '*':
+            modified, dataset_id = _decode_cursor(cursor)
+            fq.append('+(metadata_modified:{{{0} TO *}} OR '
+                      '(+metadata_modified:"{0}" +id:{{{1} TO *}}))'
+                      .format(modified, dataset_id))
+        search_data_dict = {
+            'q': '*:*',
+            'fq': ' '.join(fq),
+            'rows': n,
+            'sort': 'metadata_modified asc, id asc',
+        }
+
+    if _get_precomputed_json():
+        # The stored DCAT JSON will be used, only the ids are needed
+        return _lean_search(search_data_dict, ['id', 'metadata_modified'])
+
+    if p.toolkit.asbool(config.get('ckanext.dcat.lean_search', False)):
+        return _lean_search(search_data_dict)
+
     query = p.toolkit.get_action('package_search')(context, search_data_dict)
 
     return query['results']
+
+
+# Index fields with the values used by converters.ckan_to_dcat (and the
+# cursor), other than the resource ones
+LEAN_SEARCH_FIELDS = [
+    'id', 'metadata_modified', 'title', 'notes', 'url', 'tags',
+    'maintainer', 'maintainer_email',
+    'extras_dcat_issued', 'extras_dcat_modified', 'extras_language',
+    'extras_dcat_publisher_name', 'extras_dcat_publisher_email',
+    'extras_guid',
+]
+
+
+def _lean_search(search_data_dict, fields=None):
+    '''
+    Runs a search directly on the search index, requesting only the fields
+    needed to build the DCAT representation of the datasets, instead of
+    the whole validated dataset dicts as package_search does.
+
+    Returns minimal dataset dicts with just those fields. Their resources
+    are read from the database, as the multivalued resource fields on the
+    index do not keep empty values, so they can not be matched to each
+    resource.
+
+    If `fields` is provided, dicts with just those fields are returned
+    instead.
+    '''
+    query = dict(search_data_dict)
+    # Same filters as package_search applies
+    query['fq'] = '+capacity:public ' + query['fq']
+    query['fl'] = ' '.join(fields or LEAN_SEARCH_FIELDS)
+
+    results = query_for(model.Package).run(query)['results']
+
+    if fields:
+        return [dict((field, result.get(field)) for field in fields)
+                for result in results]
+
+    resources = _get_resources([result['id'] for result in results])
+
+    return [converters.lean_result_to_package_dict(result,
+                                                   resources[result['id']])
+            for result in results]
+
+
+def _get_resources(package_ids):
+    '''
+    Returns a dict with the ids of the given datasets as keys, and a list
+    with their active resources in order as values. Resources are dicts with
+    the fields used by converters.ckan_to_dcat.
+    '''
+    resources = dict((package_id, []) for package_id in package_ids)
+    if not package_ids:
+        return resources
+
+    fields = converters.DISTRIBUTION_RESOURCE_FIELDS
+    columns = [getattr(model.Resource, field) for field in fields]
+
+    if hasattr(model.Resource, 'package_id'):
+        package_id = model.Resource.package_id
+        query = model.Session.query(package_id, *columns)
+    else:
+        # Resources belong to a resource group on older versions of CKAN
+        package_id = model.ResourceGroup.package_id
+        query = model.Session.query(package_id, *columns) \
+                     .join(model.ResourceGroup,
+                           model.Resource.resource_group_id==model.ResourceGroup.id)
+
+    query = query.filter(package_id.in_(package_ids)) \
+                 .filter(model.Resource.state=='active') \
+                 .order_by(model.Resource.position)
+
+    for row in query:
+        resources[row[0]].append(dict(zip(fields, row[1:])))
+
+    return resources
@@ -0,0 +1,335 @@
+import os
+import json
+import shutil
+import tempfile
+from hashlib import sha1
+from contextlib import contextmanager
+
+from ckanext.dcat import compress
+
+PAGE_FILE_NAME = '{0}.json'
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+@contextmanager
+def atomic_path(path):
+    '''
+    Yields the path of a temporary file next to `path`, and moves it to
+    `path` if no errors were raised, so `path` is never left incomplete
+    '''
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                     prefix='.dcat-')
+    os.close(fd)
+    try:
+        yield temp_path
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _write_atomically(path, write):
+    '''
+    Calls `write` with a file object to write the contents of `path`
+    '''
+    with atomic_path(path) as temp_path:
+        with open(temp_path, 'w') as f:
+            write(f)
+
+
+class ShardedDump(object):
+    '''
+    A static JSON dump of the catalog, kept as a set of shards along with a
+    sidecar index, so it can be updated incrementally.
+
+    Shards are files in the `<path>.shards` directory with up to
+    `shard_size` datasets, one per line (the dataset id, a tab and its
+    serialized DCAT representation). The index (`<path>.index.json`) has
+    the date the dump was generated, and the shard, offset and last
+    modification date of each dataset.
+
+    When datasets change only the shards that contain them are rewritten,
+    and the dump file is then assembled from all shards.
+    '''
+
+    def __init__(self, path, shard_size=1000):
+        self.path = os.path.abspath(path)
+        self.shards_dir = self.path + '.shards'
+        self.index_path = self.path + '.index.json'
+        self.shard_size = shard_size
+        self.generated = None
+        # Dataset id -> [shard, offset, modified]
+        self.datasets = {}
+        self.num_shards = 0
+
+    def load(self):
+        '''
+        Loads the index of a previous run. Returns False if there is none.
+        '''
+        if not os.path.exists(self.index_path):
+            return False
+
+        with open(self.index_path, 'r') as f:
+            index = json.load(f)
+
+        self.generated = index['generated']
+        self.shard_size = index['shard_size']
+        self.num_shards = index['shards']
+        self.datasets = index['datasets']
+
+        return True
+
+    def save(self, generated):
+        '''
+        Writes the index, with `generated` as the generation date
+        '''
+        self.generated = generated
+        index = {
+            'generated': generated,
+            'shard_size': self.shard_size,
+            'shards': self.num_shards,
+            'datasets': self.datasets,
+        }
+        _write_atomically(self.index_path,
+                          lambda f: json.dump(index, f, separators=(',', ':')))
+
+    def _shard_path(self, shard):
+        return os.path.join(self.shards_dir, '{0:05d}.json'.format(shard))
+
+    def _read_shard(self, shard):
+        '''
+        Returns a list of (id, serialized dataset) tuples with the contents
+        of a shard
+        '''
+        path = self._shard_path(shard)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r') as f:
+            return [tuple(line.rstrip('\n').split('\t', 1)) for line in f]
+
+    def _write_shard(self, shard, entries):
+        '''
+        Writes the (id, serialized dataset) entries of a shard, and updates
+        their offsets on the index
+        '''
+        def write(f):
+            for dataset_id, dataset_json in entries:
+                f.write('{0}\t{1}\n'.format(dataset_id, dataset_json))
+        _write_atomically(self._shard_path(shard), write)
+
+        for offset, (dataset_id, dataset_json) in enumerate(entries):
+            self.datasets[dataset_id][:2] = [shard, offset]
+
+    def rebuild(self, datasets):
+        '''
+        Writes all shards from scratch, from an iterable of
+        (id, modified, serialized dataset) tuples
+        '''
+        if not os.path.exists(self.shards_dir):
+            os.makedirs(self.shards_dir)
+
+        self.datasets = {}
+        shard, entries = 0, []
+        for dataset_id, modified, dataset_json in datasets:
+            if dataset_id in self.datasets:
+                continue
+            self.datasets[dataset_id] = [shard, len(entries), modified]
+            entries.append((dataset_id, dataset_json))
+            if len(entries) == self.shard_size:
+                self._write_shard(shard, entries)
+                shard, entries = shard + 1, []
+        if entries or shard == 0:
+            self._write_shard(shard, entries)
+            shard += 1
+
+        self._remove_shards_from(shard)
+        self.num_shards = shard
+
+    def update(self, datasets, deleted_ids):
+        '''
+        Applies the changes to the shards that contain the changed datasets,
+        from an iterable of (id, modified, serialized dataset) tuples with
+        the created or updated ones, and the ids of the deleted ones. New
+        datasets are added to the last shards. If a dataset is listed more
+        than once only the first one is used (the most recent one, when
+        listed by modification date).
+
+        Datasets on the shards that are not on the index (appended by a
+        previous run that was interrupted before saving it) are dropped, so
+        running it again gives the same result.
+
+        Returns the number of shards rewritten.
+        '''
+        changed = {}
+        new = []
+        seen = set()
+        for dataset_id, modified, dataset_json in datasets:
+            if dataset_id in seen:
+                continue
+            seen.add(dataset_id)
+            if dataset_id in self.datasets:
+                self.datasets[dataset_id][2] = modified
+                shard = self.datasets[dataset_id][0]
+                changed.setdefault(shard, {})[dataset_id] = dataset_json
+            else:
+                new.append((dataset_id, dataset_json))
+                self.datasets[dataset_id] = [None, None, modified]
+
+        deleted = {}
+        for dataset_id in deleted_ids:
+            if dataset_id in self.datasets:
+                shard = self.datasets.pop(dataset_id)[0]
+                deleted.setdefault(shard, set()).add(dataset_id)
+
+        # Shards added by an interrupted run are not on the index
+        self._remove_shards_from(self.num_shards)
+
+        last_shard = max(self.num_shards - 1, 0)
+        affected = set(changed) | set(deleted)
+        if new or self._has_unindexed(last_shard):
+            affected.add(last_shard)
+
+        for shard in sorted(affected):
+            entries = []
+            for dataset_id, dataset_json in self._read_shard(shard):
+                if not self._is_indexed(dataset_id, shard):
+                    # Deleted, or appended by an interrupted run
+                    continue
+                dataset_json = changed.get(shard, {}).get(dataset_id,
+                                                          dataset_json)
+                entries.append((dataset_id, dataset_json))
+
+            if shard == last_shard:
+                # Fill the last shard with new datasets, and add more shards
+                # if needed
+                while new:
+                    free = self.shard_size - len(entries)
+                    entries.extend(new[:free])
+                    new = new[free:]
+                    if new:
+                        self._write_shard(shard, entries)
+                        shard, entries = shard + 1, []
+
+            self._write_shard(shard, entries)
+            self.num_shards = max(self.num_shards, shard + 1)
+
+        return len(affected)
+
+    def _is_indexed(self, dataset_id, shard):
+        '''
+        Whether a dataset is on the index as being on the given shard
+        '''
+        return self.datasets.get(dataset_id, [None])[0] == shard
+
+    def _has_unindexed(self, shard):
+        '''
+        Whether a shard has datasets that are not on the index as being on it
+        '''
+        return any(not self._is_indexed(dataset_id, shard)
+                   for dataset_id, dataset_json in self._read_shard(shard))
+
+    def _remove_shards_from(self, shard):
+        while os.path.exists(self._shard_path(shard)):
+            os.remove(self._shard_path(shard))
+            shard += 1
+
+    def write_output(self, gzip=False):
+        '''
+        Writes the dump file joining the contents of all the shards as a JSON
+        list, and optionally a compressed copy of it with a .gz extension
+        '''
+        def write(f):
+            f.write('[')
+            first = True
+            for shard in xrange(self.num_shards):
+                for dataset_id, dataset_json in self._read_shard(shard):
+                    if not first:
+                        f.write(', ')
+                    f.write(dataset_json)
+                    first = False
+            f.write(']')
+        _write_atomically(self.path, write)
+
+        if gzip:
+            with atomic_path(self.path + '.gz') as temp_path:
+                compress.gzip_file(self.path, temp_path)
+
+
+def write_pages(pages, directory, datasets_per_page, generated, gzip=False):
+    '''
+    Writes the catalog as one file per page, with the same contents as the
+    pages of the DCAT JSON endpoint, from an iterable of lists of serialized
+    datasets. As on the endpoint, the page after the last one is an empty
+    list.
+
+    A manifest.json file lists the number of datasets and SHA1 hash of each
+    page, along with the total number of datasets and the `generated` date.
+    With `gzip`, a compressed copy of each page is also written, with a .gz
+    extension.
+
+    All files are written to a temporary directory, which then replaces
+    `directory`. Returns the manifest.
+    '''
+    directory = os.path.abspath(directory.rstrip(os.sep))
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(directory),
+                                prefix='.dcat-')
+    try:
+        shards = []
+        for datasets in pages:
+            shards.append(_write_page(temp_dir, len(shards) + 1, datasets,
+                                      gzip))
+        shards.append(_write_page(temp_dir, len(shards) + 1, [], gzip))
+
+        manifest = {
+            'generated': generated,
+            'datasets_per_page': datasets_per_page,
+            'datasets': sum(shard['datasets'] for shard in shards),
+            'pages': len(shards),
+            'shards': shards,
+        }
+        with open(os.path.join(temp_dir, MANIFEST_FILE_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        for file_name in os.listdir(temp_dir):
+            os.chmod(os.path.join(temp_dir, file_name), 0644)
+        os.chmod(temp_dir, 0755)
+
+        _replace_directory(temp_dir, directory)
+    finally:
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+    return manifest
+
+
+def _write_page(directory, page, datasets, gzip):
+    content = '[' + ', '.join(datasets) + ']'
+    file_name = PAGE_FILE_NAME.format(page)
+
+    with open(os.path.join(directory, file_name), 'w') as f:
+        f.write(content)
+    if gzip:
+        with open(os.path.join(directory, file_name + '.gz'), 'wb') as f:
+            f.write(compress.gzip_string(content, 9))
+
+    return {
+        'page': page,
+        'file': file_name,
+        'datasets': len(datasets),
+        'sha1': sha1(content).hexdigest(),
+    }
+
+
+def _replace_directory(new_dir, directory):
+    '''
+    Moves `new_dir` to `directory`, removing the existing one. There is a
+    short time when `directory` does not exist.
+    '''
+    if os.path.exists(directory):
+        old_dir = new_dir + '.old'
+        os.rename(directory, old_dir)
+        os.rename(new_dir, directory)
+        shutil.rmtree(old_dir)
+    else:
+        os.rename(new_dir, directory)
@@ -0,0 +1,57 @@
+from ckanext.dcat.cache import MemoryCache
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMemoryCache(object):
+
+    def test_get_set(self):
+        cache = MemoryCache()
+
+        assert cache.get('a') is None
+
+        cache.set('a', 'value a')
+
+        assert cache.get('a') == 'value a'
+
+    def test_least_recently_used_discarded(self):
+        cache = MemoryCache(max_size=2)
+
+        cache.set('a', 'value a')
+        cache.set('b', 'value b')
+        cache.get('a')
+        cache.set('c', 'value c')
+
+        assert len(cache) == 2
+        assert cache.get('a') == 'value a'
+        assert cache.get('b') is None
+        assert cache.get('c') == 'value c'
+
+    def test_expired(self):
+        clock = Clock()
+        cache = MemoryCache(ttl=10, clock=clock)
+
+        cache.set('a', 'value a')
+        clock.now += 9
+
+        assert cache.get('a') == 'value a'
+
+        clock.now += 1
+
+        assert cache.get('a') is None
+
+    def test_invalidate(self):
+        cache = MemoryCache()
+
+        cache.set('a', 'value a')
+        cache.invalidate()
+
+        assert cache.get('a') is None
+        assert len(cache) == 0
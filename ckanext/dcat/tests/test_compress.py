@@ -0,0 +1,65 @@
+import os
+import gzip
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from ckanext.dcat.compress import (accepts_gzip, gzip_string, iter_gzip,
+                                   gzip_file)
+
+
+def _gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+
+class TestAcceptsGzip(object):
+
+    def test_accepted(self):
+        assert accepts_gzip('gzip')
+        assert accepts_gzip('gzip, deflate')
+        assert accepts_gzip('deflate, GZIP;q=0.5')
+        assert accepts_gzip('x-gzip')
+        assert accepts_gzip('*')
+
+    def test_not_accepted(self):
+        assert not accepts_gzip(None)
+        assert not accepts_gzip('')
+        assert not accepts_gzip('deflate')
+        assert not accepts_gzip('gzip;q=0')
+        assert not accepts_gzip('gzip;q=0, *')
+        assert not accepts_gzip('*;q=0')
+        assert not accepts_gzip('gzip;q=wrong')
+
+
+class TestGzip(object):
+
+    content = '[' + ', '.join(['{"title": "Dataset %s"}' % i
+                               for i in range(1000)]) + ']'
+
+    def test_gzip_string(self):
+        compressed = gzip_string(self.content)
+
+        assert len(compressed) < len(self.content)
+        assert _gunzip(compressed) == self.content
+
+    def test_iter_gzip(self):
+        chunks = [self.content[i:i + 100]
+                  for i in range(0, len(self.content), 100)]
+
+        compressed = ''.join(iter_gzip(iter(chunks), level=1))
+
+        assert _gunzip(compressed) == self.content
+
+    def test_gzip_file(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, 'catalog.json')
+            with open(path, 'w') as f:
+                f.write(self.content)
+
+            gzip_file(path, path + '.gz')
+
+            with open(path + '.gz', 'rb') as f:
+                assert _gunzip(f.read()) == self.content
+        finally:
+            shutil.rmtree(temp_dir)
@@ -43,3 +43,124 @@ class TestConverters(object):
 
         assert ckan_dict == expected_ckan_dict, self._poor_mans_dict_diff(
             expected_ckan_dict, ckan_dict)
+
+    def test_lean_result_to_package_dict(self):
+        # Resources with missing fields, which are dropped from the
+        # multivalued resource fields on the search index
+        resources = [
+            {'name': 'CSV file', 'description': None, 'format': 'CSV',
+             'size': 1024, 'url': 'http://example.com/data.csv'},
+            {'name': 'Documentation', 'description': 'User guide',
+             'format': '', 'size': None, 'url': 'http://example.com/doc'},
+            {'name': None, 'description': 'API', 'format': 'JSON',
+             'size': None, 'url': 'http://example.com/api'},
+        ]
+        package_search_result = {
+            'id': 'c1f2e8a4-7d0b-4f5e-9a3c-2b6d8e0f1a2b',
+            'name': 'test-dataset',
+            'metadata_modified': '2014-05-01T10:00:00.000000',
+            'title': 'Test dataset',
+            'notes': 'Some description',
+            'url': 'http://example.com',
+            'maintainer': 'Maintainer',
+            'maintainer_email': 'maintainer@example.com',
+            'state': 'active',
+            'tags': [{'name': 'economy', 'display_name': 'economy'},
+                     {'name': 'finance', 'display_name': 'finance'}],
+            'extras': [{'key': 'dcat_issued', 'value': '2014-01-01'},
+                       {'key': 'language', 'value': 'en,es'},
+                       {'key': 'guid', 'value': 'http://example.com/1'}],
+            'resources': [dict(resource, id=str(i), position=i,
+                               state='active')
+                          for i, resource in enumerate(resources)],
+        }
+        lean_result = {
+            'id': 'c1f2e8a4-7d0b-4f5e-9a3c-2b6d8e0f1a2b',
+            'metadata_modified': '2014-05-01T10:00:00Z',
+            'title': 'Test dataset',
+            'notes': 'Some description',
+            'url': 'http://example.com',
+            'maintainer': 'Maintainer',
+            'maintainer_email': 'maintainer@example.com',
+            'tags': ['economy', 'finance'],
+            'extras': {'dcat_issued': '2014-01-01', 'language': 'en,es',
+                       'guid': 'http://example.com/1'},
+        }
+
+        package_dict = converters.lean_result_to_package_dict(lean_result,
+                                                              resources)
+
+        expected_dcat_dict = converters.ckan_to_dcat(package_search_result)
+        dcat_dict = converters.ckan_to_dcat(package_dict)
+
+        assert dcat_dict == expected_dcat_dict, self._poor_mans_dict_diff(
+            expected_dcat_dict, dcat_dict)
+        assert dcat_dict['distribution'][1]['description'] == 'User guide'
+
+    def test_lean_result_to_package_dict_index_document(self):
+        # A document as stored on the search index: fields without a value
+        # are missing, tags are a plain list and extras are flattened into
+        # extras_* fields
+        resources = [
+            {'name': 'CSV file', 'description': '', 'format': 'CSV',
+             'size': None, 'url': 'http://example.com/data.csv'},
+        ]
+        package_show_result = {
+            'id': 'd2a3f9b5-8e1c-4a6f-8b4d-3c7e9f1a2b3c',
+            'name': 'index-dataset',
+            'metadata_modified': '2014-06-01T12:00:00.000000',
+            'title': 'Index dataset',
+            'notes': None,
+            'url': None,
+            'maintainer': 'Maintainer',
+            'maintainer_email': None,
+            'state': 'active',
+            'tags': [{'name': 'transport', 'display_name': 'transport'}],
+            'extras': [{'key': 'dcat_modified', 'value': '2014-05-30'},
+                       {'key': 'dcat_publisher_name', 'value': 'Publisher'},
+                       {'key': 'harvest_object_id', 'value': 'abc'}],
+            'resources': [dict(resource, id='0', position=0, state='active')
+                          for resource in resources],
+        }
+        index_document = {
+            'id': 'd2a3f9b5-8e1c-4a6f-8b4d-3c7e9f1a2b3c',
+            'metadata_modified': '2014-06-01T12:00:00Z',
+            'title': 'Index dataset',
+            'maintainer': 'Maintainer',
+            'tags': ['transport'],
+            'extras_dcat_modified': '2014-05-30',
+            'extras_dcat_publisher_name': 'Publisher',
+        }
+
+        # As returned by the search query, with the extras on a dict
+        search_result = {
+            'id': 'd2a3f9b5-8e1c-4a6f-8b4d-3c7e9f1a2b3c',
+            'metadata_modified': '2014-06-01T12:00:00Z',
+            'title': 'Index dataset',
+            'maintainer': 'Maintainer',
+            'tags': ['transport'],
+            'extras': {'dcat_modified': '2014-05-30',
+                       'dcat_publisher_name': 'Publisher'},
+        }
+
+        expected_dcat_dict = converters.ckan_to_dcat(package_show_result)
+
+        for result in (index_document, search_result):
+            package_dict = converters.lean_result_to_package_dict(result,
+                                                                  resources)
+            dcat_dict = converters.ckan_to_dcat(package_dict)
+
+            assert dcat_dict == expected_dcat_dict, self._poor_mans_dict_diff(
+                expected_dcat_dict, dcat_dict)
+
+        # Without tags or extras
+        package_show_result.update({'tags': [], 'extras': []})
+        index_document = dict((key, value) for key, value
+                              in index_document.iteritems()
+                              if key != 'tags' and not key.startswith('extras_'))
+
+        package_dict = converters.lean_result_to_package_dict(index_document,
+                                                              resources)
+
+        assert (converters.ckan_to_dcat(package_dict) ==
+                converters.ckan_to_dcat(package_show_result))
@@ -0,0 +1,156 @@
+import os
+
+from lxml import etree
+
+from ckanext.dcat.formats import xml
+
+
+class TestDCATDataset(object):
+
+    def _get_file_contents(self, file_name):
+        path = os.path.join(os.path.dirname(__file__),
+                            '..', '..', '..', 'examples',
+                            file_name)
+        with open(path, 'r') as f:
+            return f.read()
+
+    def _get_multilingual_dataset(self):
+        return '''<?xml version="1.0"?>
+<rdf:RDF
+    xmlns:dct="http://purl.org/dc/terms/"
+    xmlns:dcat="http://www.w3.org/ns/dcat#"
+    xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+<dcat:Dataset rdf:about="http://example.com/datasets/1">
+    <dct:title xml:lang="ca">Qualitat de l'aire</dct:title>
+    <dct:title xml:lang="es">Calidad del aire</dct:title>
+    <dct:title xml:lang="en">Air quality</dct:title>
+    <dct:description>No language</dct:description>
+    <dcat:keyword xml:lang="es">aire</dcat:keyword>
+    <dcat:keyword xml:lang="en">air</dcat:keyword>
+    <dcat:keyword xml:lang="en">quality</dcat:keyword>
+</dcat:Dataset>
+</rdf:RDF>
+'''
+
+    def _get_edge_cases_dataset(self):
+        return '''<?xml version="1.0"?>
+<rdf:RDF
+    xmlns:dct="http://purl.org/dc/terms/"
+    xmlns:dcat="http://www.w3.org/ns/dcat#"
+    xmlns:foaf="http://xmlns.com/foaf/0.1/"
+    xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+<dcat:Dataset>
+    <dct:identifier>dataset-1</dct:identifier>
+    <dct:title xml:lang="en">Title <!-- comment --> with a comment</dct:title>
+    <dct:publisher rdf:about="http://example.com/publisher"/>
+    <dcat:distribution>
+        <dcat:Distribution>
+            <dct:license>http://example.com/license/1</dct:license>
+            <dct:format><dct:IMT><rdf:value>text/csv</rdf:value></dct:IMT></dct:format>
+            <dct:format>CSV</dct:format>
+        </dcat:Distribution>
+    </dcat:distribution>
+    <dcat:distribution>
+        <dcat:Distribution>
+            <dct:license rdf:resource="http://example.com/license/2"/>
+            <dct:format>CSV</dct:format>
+        </dcat:Distribution>
+    </dcat:distribution>
+</dcat:Dataset>
+<dcat:Dataset>
+    <dct:publisher>Publisher name</dct:publisher>
+</dcat:Dataset>
+</rdf:RDF>
+'''
+
+    def test_engines_parity(self):
+        documents = [
+            (xml.DCATDataset, self._get_file_contents('dataset.rdf')),
+            (xml.DCATDataset, self._get_file_contents('catalog_datasets_list.rdf')),
+            (xml.DCATCatalog, self._get_file_contents('catalog.rdf')),
+            (xml.DCATDataset, self._get_multilingual_dataset()),
+            (xml.DCATDataset, self._get_edge_cases_dataset()),
+        ]
+        for document_class, content in documents:
+            for lang in ('en', 'es', None):
+                xpath_values = document_class(content, lang=lang).read_values()
+                dispatch_values = document_class(content, lang=lang,
+                                                 engine='dispatch').read_values()
+
+                assert xpath_values == dispatch_values, (xpath_values,
+                                                         dispatch_values)
+
+    def test_engines_parity_all_datasets(self):
+        contents = [
+            self._get_file_contents('catalog.rdf'),
+            self._get_file_contents('catalog_datasets_list.rdf'),
+            self._get_edge_cases_dataset(),
+        ]
+        for content in contents:
+            tree = etree.fromstring(content)
+            for element in tree.iter('{http://www.w3.org/ns/dcat#}Dataset'):
+                xpath_values = xml.DCATDataset(xml_tree=element).read_values()
+                dispatch_values = xml.DCATDataset(xml_tree=element,
+                                                  engine='dispatch').read_values()
+
+                assert xpath_values == dispatch_values
+
+    def test_dispatch_unsupported_paths_use_xpath(self):
+        element = xml.DCATElement(
+            name='title',
+            search_paths=['dct:title[1]/text()'],
+            multiplicity='0..1',
+        )
+        dispatcher = xml.TagDispatcher([element])
+
+        assert dispatcher.paths == [None]
+
+        tree = etree.fromstring(self._get_multilingual_dataset())[0]
+
+        assert dispatcher.read_values(tree) == {'title': "Qualitat de l'aire"}
+
+    def test_read_values(self):
+        dataset = xml.DCATDataset(self._get_file_contents('dataset.rdf'))
+
+        values = dataset.read_values()
+
+        assert values['title'] == 'Zimbabwe Regional Geochemical Survey.'
+        assert values['identifier'] == 'https://data.some.org/catalog/datasets/9df8df51-63db-37a8-e044-0003ba9b0d98'
+        assert values['language'] == ['en', 'es', 'ca']
+        assert len(values['keyword']) == 7
+        assert values['landingPage'] == ''
+        assert values['publisher'] == {
+            'name': 'Publishing Organization for dataset 1',
+            'email': 'contact@some.org',
+        }
+        assert values['distribution'] == [{
+            'title': '',
+            'description': 'Resource locator',
+            'issued': '',
+            'modified': '',
+            'license': '',
+            'accessURL': 'http://www.bgs.ac.uk/gbase/geochemcd/home.html',
+            'downloadURL': '',
+            'byteSize': '',
+            'format': 'text/html',
+        }]
+
+    def test_read_values_multilingual(self):
+        content = self._get_multilingual_dataset()
+
+        values = xml.DCATDataset(content, lang='es').read_values()
+
+        assert values['title'] == 'Calidad del aire'
+        assert values['description'] == 'No language'
+        assert values['keyword'] == ['aire']
+
+        values = xml.DCATDataset(content, lang='en').read_values()
+
+        assert values['title'] == 'Air quality'
+        assert values['keyword'] == ['air', 'quality']
+
+        # Fall back to all values if there are none in the language
+        values = xml.DCATDataset(content, lang='de').read_values()
+
+        assert values['title'] == "Qualitat de l'aire"
+        assert values['keyword'] == ['aire', 'air', 'quality']
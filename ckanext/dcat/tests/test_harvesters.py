@@ -0,0 +1,49 @@
+import mock
+
+from ckan import logic
+
+from ckanext.dcat import harvesters
+
+
+class TestIndexPackages(object):
+
+    @mock.patch('ckanext.dcat.harvesters.p.toolkit.get_action')
+    @mock.patch('ckanext.dcat.harvesters.search')
+    def test_single_commit(self, mock_search, mock_get_action):
+
+        def package_show(context, data_dict):
+            if data_dict['id'] == 'missing':
+                raise logic.NotFound
+            return {'id': data_dict['id']}
+        mock_get_action.return_value = package_show
+
+        package_index = mock_search.index_for.return_value
+
+        harvesters._index_packages(['a', 'missing', 'b'])
+
+        assert package_index.update_dict.call_args_list == [
+            mock.call({'id': 'a'}, defer_commit=True),
+            mock.call({'id': 'b'}, defer_commit=True),
+        ]
+        package_index.delete_package.assert_called_once_with(
+            {'id': 'missing'})
+        assert mock_search.commit.call_count == 1
+
+    @mock.patch('ckanext.dcat.harvesters.p.toolkit.get_action')
+    @mock.patch('ckanext.dcat.harvesters.search')
+    def test_solr_commit_disabled(self, mock_search, mock_get_action):
+
+        commit_options = []
+
+        def delete_package(pkg_dict):
+            commit_options.append(
+                harvesters.config.get('ckan.search.solr_commit'))
+        mock_search.index_for.return_value.delete_package = delete_package
+        mock_get_action.return_value = mock.Mock(side_effect=logic.NotFound)
+
+        previous = harvesters.config.get('ckan.search.solr_commit')
+
+        harvesters._index_packages(['missing'])
+
+        assert commit_options == ['false']
+        assert harvesters.config.get('ckan.search.solr_commit') == previous
@@ -0,0 +1,66 @@
+import os
+import json
+from StringIO import StringIO
+
+from nose.tools import assert_raises
+
+from ckanext.dcat.formats import json_stream
+
+
+class TestJSONStream(object):
+
+    def _get_file_contents(self, file_name):
+        path = os.path.join(os.path.dirname(__file__),
+                            '..', '..', '..', 'examples',
+                            file_name)
+        with open(path, 'r') as f:
+            return f.read()
+
+    def _iter_datasets(self, content, chunk_size=json_stream.CHUNK_SIZE):
+        return list(json_stream.iter_datasets(StringIO(content), chunk_size))
+
+    def test_datasets_list(self):
+        content = self._get_file_contents('catalog_datasets_list.json')
+
+        for chunk_size in (1, 7, json_stream.CHUNK_SIZE):
+            datasets = self._iter_datasets(content, chunk_size)
+
+            assert [dataset for dataset, raw in datasets] == json.loads(content)
+            for dataset, raw in datasets:
+                assert json.loads(raw) == dataset
+                assert raw in content
+
+    def test_catalog(self):
+        content = self._get_file_contents('catalog.json')
+
+        for chunk_size in (1, 7, json_stream.CHUNK_SIZE):
+            datasets = self._iter_datasets(content, chunk_size)
+
+            assert ([dataset for dataset, raw in datasets] ==
+                    json.loads(content)['dataset'])
+
+    def test_keys_after_datasets_are_ignored(self):
+        content = '{"title": "[{\\"", "dataset": [{"a": 1}], "b": [1, 2]}'
+
+        assert self._iter_datasets(content) == [({'a': 1}, '{"a": 1}')]
+
+    def test_raw_text_is_kept(self):
+        content = '[ {"a" : "x\\\\"} ,{"b": [1, {"c": "]}"}], "d": null}]'
+
+        for chunk_size in (1, 2, 3):
+            datasets = self._iter_datasets(content, chunk_size)
+
+            assert ([raw for dataset, raw in datasets] ==
+                    ['{"a" : "x\\\\"}', '{"b": [1, {"c": "]}"}], "d": null}'])
+
+    def test_empty(self):
+        assert self._iter_datasets('[]') == []
+        assert self._iter_datasets(' {} ') == []
+        assert self._iter_datasets('{"title": "No datasets"}') == []
+        assert self._iter_datasets('{"dataset": []}') == []
+
+    def test_wrong_documents(self):
+        for content in ('', '"dataset"', '1', '[1, 2]',
+                        '{"dataset": {"a": 1}}', '[{"a": 1}', '[{"a": "1}]',
+                        '[{"a": 1} {"b": 2}]', '{"dataset" [{"a": 1}]}'):
+            assert_raises(ValueError, self._iter_datasets, content)
@@ -0,0 +1,165 @@
+import os
+import json
+import shutil
+import tempfile
+from hashlib import sha1
+
+from ckanext.dcat.static import ShardedDump, write_pages
+
+
+def _dataset(dataset_id, title=None):
+    return (dataset_id, '2015-01-01T00:00:00',
+            json.dumps({'title': title or 'Dataset %s' % dataset_id}))
+
+
+class TestShardedDump(object):
+
+    def setup(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'catalog.json')
+
+    def teardown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _output_titles(self):
+        with open(self.path, 'r') as f:
+            return [dataset['title'] for dataset in json.load(f)]
+
+    def test_rebuild(self):
+        dump = ShardedDump(self.path, shard_size=2)
+        dump.rebuild([_dataset(str(i)) for i in range(5)])
+        dump.save('2015-01-01T00:00:00')
+        dump.write_output(gzip=True)
+
+        assert dump.num_shards == 3
+        assert dump.datasets['4'] == [2, 0, '2015-01-01T00:00:00']
+        assert self._output_titles() == ['Dataset %s' % i for i in range(5)]
+        assert os.path.exists(self.path + '.gz')
+
+    def test_empty(self):
+        dump = ShardedDump(self.path)
+        dump.rebuild([])
+        dump.write_output()
+
+        assert self._output_titles() == []
+
+    def test_load(self):
+        dump = ShardedDump(self.path, shard_size=2)
+        dump.rebuild([_dataset(str(i)) for i in range(3)])
+        dump.save('2015-01-01T00:00:00')
+
+        loaded = ShardedDump(self.path)
+
+        assert not ShardedDump(self.path + '.other').load()
+        assert loaded.load()
+        assert loaded.generated == '2015-01-01T00:00:00'
+        assert loaded.shard_size == 2
+        assert loaded.num_shards == 2
+        assert loaded.datasets == dump.datasets
+
+    def test_update(self):
+        dump = ShardedDump(self.path, shard_size=2)
+        dump.rebuild([_dataset(str(i)) for i in range(5)])
+
+        # Shards are replaced when rewritten
+        inodes = [os.stat(dump._shard_path(shard)).st_ino
+                  for shard in range(3)]
+
+        # Dataset 2 updated, 3 deleted and 5 to 7 created
+        rewritten = dump.update([_dataset('2', 'Updated 2'),
+                                 _dataset('5'), _dataset('6'),
+                                 _dataset('7'), _dataset('5', 'Old 5')],
+                                ['3'])
+        dump.write_output()
+
+        assert rewritten == 2
+        assert os.stat(dump._shard_path(0)).st_ino == inodes[0]
+        assert os.stat(dump._shard_path(1)).st_ino != inodes[1]
+        assert dump.num_shards == 4
+        assert '3' not in dump.datasets
+        assert dump.datasets['2'] == [1, 0, '2015-01-01T00:00:00']
+        assert dump.datasets['7'] == [3, 1, '2015-01-01T00:00:00']
+        assert self._output_titles() == [
+            'Dataset 0', 'Dataset 1', 'Updated 2', 'Dataset 4', 'Dataset 5',
+            'Dataset 6', 'Dataset 7']
+
+
+    def test_update_after_interrupted_run(self):
+        dump = ShardedDump(self.path, shard_size=2)
+        dump.rebuild([_dataset(str(i)) for i in range(3)])
+        dump.save('2015-01-01T00:00:00')
+
+        # Shards updated, but the run is interrupted before saving the index
+        dump.update([_dataset('3'), _dataset('4')], [])
+
+        dump = ShardedDump(self.path)
+        dump.load()
+        dump.update([_dataset('3'), _dataset('4')], [])
+        dump.save('2015-01-02T00:00:00')
+        dump.write_output()
+
+        assert dump.num_shards == 3
+        assert self._output_titles() == ['Dataset %s' % i for i in range(5)]
+
+        # Interrupted again, and the new datasets are deleted meanwhile
+        dump.update([_dataset(str(i)) for i in range(5, 8)], [])
+        assert os.path.exists(dump._shard_path(3))
+
+        dump = ShardedDump(self.path)
+        dump.load()
+        rewritten = dump.update([], [])
+        dump.write_output()
+
+        assert rewritten == 1
+        assert dump.num_shards == 3
+        assert not os.path.exists(dump._shard_path(3))
+        assert self._output_titles() == ['Dataset %s' % i for i in range(5)]
+
+
+class TestWritePages(object):
+
+    def setup(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.temp_dir, 'pages')
+
+    def teardown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _pages(self):
+        return [[json.dumps({'title': 'Dataset %s' % i})
+                 for i in range(start, min(start + 2, 5))]
+                for start in range(0, 5, 2)]
+
+    def _read(self, file_name):
+        with open(os.path.join(self.directory, file_name), 'r') as f:
+            return f.read()
+
+    def test_pages(self):
+        manifest = write_pages(self._pages(), self.directory, 2,
+                               '2015-01-01T00:00:00', gzip=True)
+
+        assert json.loads(self._read('1.json')) == [
+            {'title': 'Dataset 0'}, {'title': 'Dataset 1'}]
+        assert json.loads(self._read('3.json')) == [{'title': 'Dataset 4'}]
+        assert self._read('4.json') == '[]'
+        assert os.path.exists(os.path.join(self.directory, '1.json.gz'))
+
+        assert manifest['generated'] == '2015-01-01T00:00:00'
+        assert manifest['datasets_per_page'] == 2
+        assert manifest['datasets'] == 5
+        assert manifest['pages'] == 4
+        assert manifest['shards'][2] == {
+            'page': 3,
+            'file': '3.json',
+            'datasets': 1,
+            'sha1': sha1(self._read('3.json')).hexdigest(),
+        }
+        assert json.loads(self._read('manifest.json')) == manifest
+
+    def test_replaces_directory(self):
+        write_pages(self._pages(), self.directory, 2, '2015-01-01T00:00:00')
+        write_pages([], self.directory, 2, '2015-01-02T00:00:00')
+
+        assert sorted(os.listdir(self.directory)) == ['1.json',
+                                                      'manifest.json']
+        assert os.listdir(self.temp_dir) == ['pages']
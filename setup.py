@@ -31,6 +31,7 @@ setup(
 
     [paste.paster_command]
     generate_static = ckanext.dcat.commands:GenerateStaticDCATCommand
+    dcat = ckanext.dcat.commands:DCATCommand
 
 	""",
 )